@@ -1,15 +1,18 @@
 import auxiliar_functions as aux
+import data_loader as loader
+import instrumentation as instr
 import pandas as pd
-import pygmt
 
-def demo(region, projection = "M17.5c", style = "c0.125c"):
+def demo(region, projection = "M17.5c", style = "c0.125c", data_cache = None):
     """
     Parameters:
         region (List of floats): min/max longitude and latitude coordinates to define the region
         projection (str): projection and size of the map
         style (str): style and size of the scatter plot in the map
+        data_cache (str): directory of the binary copies of the input files, None reads the text files
     """
-    station_locations = pd.read_csv('stations_location.txt', delimiter ="\t")
+    import pygmt
+    station_locations = loader.load_stations(cache_dir = data_cache)
     fig = pygmt.Figure()
     fig.coast(shorelines="0.8p,black", region= region, frame="a", projection=projection, borders=["1/0.8p,black", "2/0.3p,black"] ,land="#efefdb") #, water="skyblue"
     # fig.basemap(map_scale="jBL+w500k+o0.5c/0.5c+f+u") #Map Scale
@@ -20,7 +23,7 @@ def demo(region, projection = "M17.5c", style = "c0.125c"):
 ##############################################################################################################################################
 
 
-def main(compute_probs, period, grid_region, stations_region, location, cols, rows, apt_size, hour_correction = 0, style_grid = "c0.075c", style_stations = "c0.15c", projection_grid = "M17.5c", projection_stations = "M15c", img_save = 'Images'):
+def main(compute_probs, period, grid_region, stations_region, location, cols, rows, apt_size, hour_correction = 0, style_grid = "c0.075c", style_stations = "c0.15c", projection_grid = "M17.5c", projection_stations = "M15c", img_save = 'Images', n_workers = 1, binning = 'hexagonal', fit_cache = None, headless = False, dpi = 650, img_format = 'png', data_cache = None, resume = False, profiler = None, estimator = 'distfit', bootstrap = 0, stream_tcs = False, confidence = aux.CONFIDENCE):
     """
     Paramteres: 
         
@@ -38,59 +41,76 @@ def main(compute_probs, period, grid_region, stations_region, location, cols, ro
         projection_grid (str): projection and size of the image for the grid plot
         projection_stations (str): projection and size of the image for the stations plot
         img_save (str): directory where you wish to save the final images results
+        n_workers (int): number of processes used to fit the distributions of every hexagon and station and to render the images, 1 runs serially
+        binning (str): 'hexagonal' assigns the TCs to the hexagons in one vectorized pass, 'polygon' tests them against every hexagon polygon
+        fit_cache (str): directory where the fitted distributions are cached and reused between runs, None disables the cache
+        headless (boolean): if True no plots or viewers are opened and pygmt is never imported, only the grid and probabilities are computed.
+                            The images can be rendered later from render_manifest.json with plot_functions.render_figures
+        dpi (int): resolution of the probabilities images
+        img_format (str): format of the probabilities images (png, jpg, pdf...)
+        data_cache (str): directory where the input text files are converted once into memory mapped binary copies ,
+                          rebuilt when the text files change. They hold the same values as the text files. None reads the text files
+        resume (boolean): if True the hexagons already saved in computed_probabilities.csv.checkpoint by a previous run with the same inputs are not computed again
+        profiler (instrumentation.Profiler): measures the wall time, CPU time and peak memory of every stage and the time of every hexagon and
+                                             fit, and saves the run report at the end (see its report_path). None disables the measurements
+        estimator (str): 'distfit' fits a distribution to the induced precipitation of every station, 'empirical' uses the fraction of
+                         samples above each threshold, computed for all stations at once (for quick looks and grid exploration)
+        bootstrap (int): number of bootstrap replicates of the induced precipitation of every hexagon used to add a confidence interval
+                         of every probability to computed_probabilities.csv (%Green_low, %Green_high, ...). 0 does not compute them.
+                         Only available with estimator = 'empirical', since they are intervals of the exceedance frequency
+        stream_tcs (boolean): if True TCs_data.txt is read in chunks and only the records within aux.STREAM_MARGIN degrees of the grid are
+                              averaged (aux.stream_daily_means), so large archives are never held in memory. data_cache is not used for it
+        confidence (float): confidence level of the bootstrap intervals (0.9 by default)
         
     Process:
         Makes the hexagonal grid and computing of probabilities starting from raw data
+        
+    Return:
+        hex_grid.HexGrid with the induced precipitation of the TCs inside every hexagon (its to_matrix method gives the Matrix of pd DataFrame)
     """
+    aux.check_estimator(estimator, bootstrap) #before loading anything, so a wrong setting fails at once
+    
     #load precipitation data, stations location data, TCs data and Thresholds
-    prepc_data = pd.read_csv('precipitation_data.txt', delimiter = "\t", header=None)
-    station_locations = pd.read_csv('stations_location.txt', delimiter ="\t")
-    Thresholds = pd.read_csv('thresholds.csv', delimiter = ",")
-    TCs = pd.read_csv('TCs_data.txt', delimiter = "\t", header = None, skiprows=1)
+    with instr.stage(profiler, 'load_inputs'):
+        prepc_data = loader.load_precipitation(cache_dir = data_cache)
+        station_locations = loader.load_stations(cache_dir = data_cache)
+        Thresholds = pd.read_csv('thresholds.csv', delimiter = ",")
+        if not stream_tcs:
+            TCs = loader.load_tcs(cache_dir = data_cache)
     
     #set the dates of precipitation events
     fechas = pd.date_range(start=period[0], end=period[1])
     prepc_data = prepc_data.set_index(fechas) 
     
-    #setting the header and dropping the data that wont be used
-    TCs.columns = ['event', 'day', 'month', 'year', 'lat', 'lon', 'hour', 'windkph', 'press', 'typemax']
-    TCs = TCs.drop(columns = ['windkph', 'press', 'typemax'])
-    TCs = TCs.reset_index(drop=True)
-    
-    TCs = TCs.replace(',','.', regex=True)
-    TCs = TCs.astype({'lat': float, 'lon': float})
-    
-    #matching the timezone of the TCs data and precipitation data 
-    if hour_correction != 0:
-        TCs['hour'] -= hour_correction
-        aux.time_correction(TCs)
-    TCs = TCs.drop(columns = ['hour'])
-    
-    # Computing the daily average position and extracting its latitude and longitude coordinates
-    TCs_means = TCs.groupby(['year', 'month', 'day','event']).mean()      
+    #matching the timezone of the TCs data and precipitation data, and computing the daily average position of each TC
+    with instr.stage(profiler, 'daily_means', streamed = stream_tcs):
+        if stream_tcs:
+            bounds = aux.grid_bounds(cols, rows, apt_size, location[0], location[1], aux.STREAM_MARGIN)
+            TCs_means, IR_dates = aux.stream_daily_means('TCs_data.txt', hour_correction, bounds)
+        else:
+            TCs_means, IR_dates = aux.daily_means(TCs, hour_correction) #dates with precipitation index
     
-    #Setting the index of TCs data with the pd.series format to match the precipitation data index
-    IR_dates_event = TCs_means.index
-    IR_dates = aux.create_IRdf(IR_dates_event) #dates with precipitation index
-    IR_datesdf_aux = pd.Series(IR_dates) #converting IR_dates to pd.Series
-    IR_datesdf = pd.to_datetime(IR_datesdf_aux) #pd.series to pd.datetime, same as the precipitation data
-    TCs_means = TCs_means.set_index(IR_datesdf) #setting the pd.datetime as index for the TCs daily average position
-    
-    #Induced precipitation of TCs
-    IR_data = prepc_data.loc[IR_dates,:] #precipitation data that matches the day of TCs events
-    
-    #Concate TCs data with IR_data
-    TCs_IR_JOIN = pd.concat([TCs_means, IR_data], axis=1) 
+    with instr.stage(profiler, 'induced_precipitation'):
+        #Induced precipitation of TCs
+        IR_data = prepc_data.loc[IR_dates,:] #precipitation data that matches the day of TCs events
+        
+        #Concate TCs data with IR_data
+        TCs_IR_JOIN = pd.concat([TCs_means, IR_data], axis=1) 
     
     
     scale = apt_size #double of the hexagon apotheme size in degrees
     
     #Creating the Hexagonal Grid 
-    HexGrid, centers = aux.create_hex_grid(TCs_IR_JOIN, grid_region, location[0], location[1], style_grid, projection_grid, cols, rows, scale = scale) 
+    with instr.stage(profiler, 'create_hex_grid'):
+        HexGrid, centers = aux.create_hex_grid(TCs_IR_JOIN, grid_region, location[0], location[1], style_grid, projection_grid, cols, rows, scale = scale, binning = binning, headless = headless, profiler = profiler) 
     
     #Computing the probabilities
     if compute_probs:
-        aux.Probs_grid(HexGrid, centers, Thresholds, station_locations, stations_region, style_stations, projection_stations, img_save)
+        with instr.stage(profiler, 'Probs_grid'):
+            aux.Probs_grid(HexGrid, centers, Thresholds, station_locations, stations_region, style_stations, projection_stations, img_save, n_workers, fit_cache, headless, dpi, img_format, resume, profiler = profiler, estimator = estimator, bootstrap = bootstrap, confidence = confidence)
+    
+    if profiler is not None:
+        profiler.save()
         
     return HexGrid
 
@@ -1,59 +1,233 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
-from distfit import distfit
 import numpy as np
+import hashlib
+import json
+import os
+import time
 from typing import Tuple, List
-import matplotlib.path as mpltPath
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import plot_functions as plot
+import fit_cache as cache
+import data_loader as loader
+import instrumentation as instr
+import hex_grid
 
-def create_IRdf(df: pd.DataFrame) -> List[str]:
+MIN_SAMPLES = 7 #minimum number of TCs inside a hexagon to compute its probabilities
+CONFIDENCE = 0.9 #confidence level of the bootstrap intervals of the probabilities
+STREAM_MARGIN = 5. #degrees added around the grid when the TCs data is streamed, larger than the daily displacement of a TC
+THRESHOLD_QUANTILES = [0.6, 0.75, 0.9] #quantiles of the green, yellow and red thresholds
+ESTIMATORS = ('distfit', 'empirical') #estimators of the probabilities of the hexagons
+THRESHOLD_DISTRIBUTIONS = ['gamma', 'lognorm', 'expon', 'weibull_min', 'genextreme', 'genpareto', 'pareto', 'loggamma', 'beta', 'norm'] #candidates fitted to the precipitation of every station
+
+_shared_precipitation = None
+
+def create_IRdf(df: pd.MultiIndex) -> pd.DatetimeIndex:
     """
     Parameters:
-        df (pd Dataframe): Dates of TCs activity 'year-month-day'
+        df (pd MultiIndex): Dates and events of TCs activity, as returned by daily_means ('date', 'event')
     
     Return:
-        List cotaining dates of TCs activity 'year/month/day'
+        pd DatetimeIndex cotaining dates of TCs activity
+    """
+    return pd.DatetimeIndex(df.get_level_values('date')).rename(None)
+
+def tc_dates(df: pd.DataFrame, hour_correction: float = 0) -> pd.Series:
+    """
+    Parameters:
+        df (pd DataFrame): TCs data
+        hour_correction (float): hours necessary to match TCs data to the precipitation data time zone
+        
+    Return:
+        pd Series with the day of every TC record in the precipitation data time zone
     """
-    IR_dates = []
-    for year, month, day, *event in df: 
-        date = f'{int(year)}/{int(month)}/{int(day)}'
-        IR_dates.append(date)
-    return IR_dates
+    timestamps = pd.to_datetime(df[['year', 'month', 'day']].astype(int))
+    timestamps += pd.to_timedelta(df['hour'].astype(float) - hour_correction, unit = 'h')
+    return timestamps.dt.floor('D').rename('date')
 
-def get_thresholds():
+def daily_means(df: pd.DataFrame, hour_correction: float = 0) -> Tuple[pd.DataFrame, pd.DatetimeIndex]:
     """
+    Parameters:
+        df (pd DataFrame): TCs data
+        hour_correction (float): hours necessary to match TCs data to the precipitation data time zone
+        
     Process:
-        Auxiliar function to load precipitation data and call get_distribution function
+        Shifts the TCs records to the precipitation data time zone and computes the daily average position of each TC
+        
+    Return:
+        Tuple with the daily average positions ('lat', 'lon') indexed by date, and their dates
     """
-    stations = pd.read_csv('precipitation_data.txt', delimiter = "\t", header=None)
-    stations = stations[stations > 0.]
-    get_distributions(stations) 
+    TCs_means = df[['lat', 'lon']].groupby([tc_dates(df, hour_correction), df['event']]).mean()
+    IR_dates = create_IRdf(TCs_means.index)
+    TCs_means.index = IR_dates
+    return TCs_means, IR_dates
 
-def get_distributions(df: pd.DataFrame) -> None:
+def stream_daily_means(path: str, hour_correction: float, bounds: List[float], chunksize: int = 100_000) -> Tuple[pd.DataFrame, pd.DatetimeIndex]:
     """
     Parameters:
-        df (pd DataFrame): Historical data of precipitation
+        path (str): tab delimited file with the TCs data
+        hour_correction (float): hours necessary to match TCs data to the precipitation data time zone
+        bounds (List of floats): min/max longitude and latitude of the records that are kept (grid_bounds)
+        chunksize (int): number of records read at a time
         
     Process:
-        Compute the thresholds for green, yellow and red alert, and saves it in a .csv file
+        Reads the TCs data in chunks (data_loader.read_tc_chunks), drops the records outside bounds and keeps running sums and
+        counts of the positions of every (day, TC), so only the TC days near the grid are ever held in memory. A day that
+        crosses bounds is averaged over its records inside them, which does not change the grid when bounds has a margin larger
+        than the daily displacement of a TC
+        
+    Return:
+        Tuple with the daily average positions ('lat', 'lon') indexed by date, and their dates, as daily_means
     """
-    station_locations = pd.read_csv('stations_location.txt', delimiter ="\t")
-    Resultados = []
-    array = df.to_numpy() 
-    for i in range(len(df.columns)): 
-        station_data = array[:,i]
-        print(len(station_data))
-        station_data = station_data[~np.isnan(station_data)]
-        dist = distfit(distr = 'full')
-        dist.fit_transform(station_data)
-        *parametros, loc, scale =  dist.model['params']
-        dist.plot()
-        VNR = dist.model['distr'].ppf([0.6, 0.75, 0.9], *parametros, loc = loc, scale = scale)
-        Resultados.append([station_locations.iloc[0]['ID'], dist.model['name'] ,*VNR])
-        print(Resultados)
-    dataframe = pd.DataFrame(Resultados, columns = ['ID', 'distribution' , 'Green', 'Yellow', 'Red'])
-    dataframe.to_csv('thresholds.csv')
+    totals = None
+    for TCs in loader.read_tc_chunks(path, chunksize):
+        inside = TCs['lon'].between(bounds[0], bounds[1]) & TCs['lat'].between(bounds[2], bounds[3])
+        TCs = TCs[inside]
+        if TCs.empty:
+            continue
+        sums = TCs[['lat', 'lon']].assign(count = 1).groupby([tc_dates(TCs, hour_correction), TCs['event']]).sum()
+        totals = sums if totals is None else totals.add(sums, fill_value = 0)
+    if totals is None:
+        return pd.DataFrame(columns = ['lat', 'lon'], index = pd.DatetimeIndex([]), dtype = float), pd.DatetimeIndex([])
+    totals = totals.sort_index()
+    TCs_means = totals[['lat', 'lon']].div(totals['count'], axis = 0)
+    IR_dates = create_IRdf(TCs_means.index)
+    TCs_means.index = IR_dates
+    return TCs_means, IR_dates
+
+def grid_bounds(ncolumns: int, nrows: int, scale: float, xpos, ypos, margin: float = 0.) -> List[float]:
+    """
+    Parameters:
+        ncolumns (integer): number of columns of the grid
+        nrows (integer): number of rows of the grid
+        scale (float): double size of the hexagon apotheme
+        xpos (float): longitude coordinate of the lower left corner hexagon of the grid
+        ypos (float): latitude coordinate of the lower left corner hexagon of the grid
+        margin (float): degrees added on every side
+        
+    Return:
+        List with the min/max longitude and latitude of the hexagons of the grid, plus the margin
+    """
+    x_cent, y_cent = hex_centers(ncolumns, nrows, scale, xpos, ypos)
+    r = scale/np.sqrt(3)
+    return [float(min(x_cent) - r - margin), float(max(x_cent) + r + margin), float(min(y_cent) - r - margin), float(max(y_cent) + r + margin)]
 
+def get_thresholds(cache_dir: str = None, headless: bool = False, data_cache: str = None, n_workers: int = 1, chunk: int = 64, distributions: List[str] = THRESHOLD_DISTRIBUTIONS, path: str = 'thresholds.csv'):
+    """
+    Parameters:
+        cache_dir (str): directory of the fit cache, None disables it
+        headless (boolean): if True the fitted distributions are not plotted
+        data_cache (str): directory of the binary copies of the input files, None reads the text files
+        n_workers (int): number of processes fitting the stations, 1 runs serially
+        chunk (int): number of stations read from the precipitation data at a time
+        distributions (str or List of str): distributions tried by distfit for every station
+        path (str): path of the .csv file with the thresholds
+        
+    Process:
+        Auxiliar function to load precipitation data chunk by chunk and call get_distribution function
+    """
+    station_locations = loader.load_stations(cache_dir = data_cache)
+    chunks = loader.precipitation_chunks(cache_dir = data_cache, chunk = chunk)
+    get_distributions(chunks, station_locations['ID'], cache_dir, headless, n_workers, distributions, path)
+
+def station_thresholds(station_data: np.ndarray, distributions: List[str] = THRESHOLD_DISTRIBUTIONS, cache_dir: str = None, plot_fit: bool = False) -> Tuple[str, np.ndarray]:
+    """
+    Parameters:
+        station_data (np array): historical precipitation data of one station
+        distributions (str or List of str): distributions tried by distfit
+        cache_dir (str): directory of the fit cache, None disables it
+        plot_fit (boolean): if True the empirical and theoretical distributions are plotted when a new fit is made
+        
+    Process:
+        Fits the days with precipitation (missing values are left out) and takes the THRESHOLD_QUANTILES of the fitted distribution
+        
+    Return:
+        Tuple with the name of the fitted distribution and the green, yellow and red thresholds
+    """
+    station_data = station_data[station_data > 0.]
+    name, params, candidates = fit_distribution(station_data, distributions, cache_dir = cache_dir, plot_fit = plot_fit)
+    *parametros, loc, scale =  params
+    return name, cache.distribution(name).ppf(THRESHOLD_QUANTILES, *parametros, loc = loc, scale = scale)
+
+def _threshold_task(task: Tuple[np.ndarray, List[str], str]) -> Tuple[str, np.ndarray]:
+    """
+    Parameters:
+        task (Tuple): precipitation of one station, distributions tried and fit cache directory
+        
+    Return:
+        Tuple with the name of the fitted distribution and the green, yellow and red thresholds
+    """
+    return station_thresholds(*task)
+
+def get_distributions(df, IDs: pd.Series, cache_dir: str = None, headless: bool = False, n_workers: int = 1, distributions: List[str] = THRESHOLD_DISTRIBUTIONS, path: str = 'thresholds.csv') -> None:
+    """
+    Parameters:
+        df (pd DataFrame or generator): Historical data of precipitation, or chunks of stations as returned by data_loader.precipitation_chunks
+        IDs (pd Series): ID of every station, in the same order as the precipitation columns
+        cache_dir (str): directory of the fit cache, None disables it
+        headless (boolean): if True the fitted distributions are not plotted
+        n_workers (int): number of processes fitting the stations, 1 runs serially (and plots every fit unless headless)
+        distributions (str or List of str): distributions tried by distfit for every station
+        path (str): path of the .csv file with the thresholds
+        
+    Process:
+        Compute the thresholds for green, yellow and red alert, and saves it in a .csv file. The stations of every chunk are fitted
+        in a process pool, and every station is appended to the .csv file as soon as its chunk is done
+    """
+    if isinstance(df, pd.DataFrame):
+        df = [(0, df.to_numpy(dtype = float))]
+    columns = ['ID', 'distribution' , 'Green', 'Yellow', 'Red']
+    executor = ProcessPoolExecutor(max_workers = n_workers) if n_workers > 1 else None
+    try:
+        with open(path, 'w', newline = '') as thresholds:
+            pd.DataFrame(columns = columns).to_csv(thresholds)
+            for start, array in df:
+                tasks = [(array[:,i], distributions, cache_dir) for i in range(array.shape[1])]
+                if executor is not None:
+                    results = executor.map(_threshold_task, tasks)
+                else:
+                    results = (station_thresholds(*task, plot_fit = not headless) for task in tasks)
+                Resultados = [[IDs.iloc[start + i], name, *VNR] for i, (name, VNR) in enumerate(results)]
+                pd.DataFrame(Resultados, columns = columns, index = range(start, start + len(Resultados))).to_csv(thresholds, header = False)
+                thresholds.flush()
+                print(f'{start + len(Resultados)} stations')
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if cache_dir is not None:
+        cache.prune(cache_dir)
+
+def fit_distribution(station_data: np.ndarray, distr, smooth: int = None, cache_dir: str = None, plot_fit: bool = True) -> Tuple[str, List[float], int]:
+    """
+    Parameters:
+        station_data (np array): precipitation data of one station
+        distr (str or List of str): distributions tried by distfit
+        smooth (int): smoothing factor used by distfit
+        cache_dir (str): directory of the fit cache, None disables it
+        plot_fit (boolean): if True the empirical and theoretical distributions are plotted when a new fit is made
+        
+    Process:
+        Finds the best fit for the data with distfit. When a cache directory is given, fits of the same sample with the
+        same settings are loaded from it instead of being computed again
+        
+    Return:
+        Tuple with the name of the fitted distribution, its parameters (loc and scale last) and the number of distributions tried
+    """
+    if cache_dir is not None:
+        key = cache.sample_key(station_data, distr, smooth)
+        cached = cache.load_fit(cache_dir, key)
+        if cached is not None:
+            return cached
+    from distfit import distfit
+    dist = distfit(distr = distr, smooth = smooth)
+    dist.fit_transform(station_data)
+    if plot_fit:
+        dist.plot() #Plot of the empirical and theoretical distributions
+    name, params, candidates = (dist.model['name'], [float(param) for param in dist.model['params']], len(dist.summary))
+    if cache_dir is not None:
+        cache.store_fit(cache_dir, key, name, params, candidates)
+    return name, params, candidates
 
 def time_correction(df: pd.DataFrame) -> None:
     """
@@ -63,23 +237,14 @@ def time_correction(df: pd.DataFrame) -> None:
     Process:
         Modify the day, month, or year according to hour negative values
     """
-    days_of_month = {1.: 31, 2.: 28, 3.: 31, 4.: 30, 5.: 31, 6.: 30, 7.: 31, 8.: 31, 9.: 30, 10.: 31, 11.: 30, 12.: 31}
-    for i in df.index:
-        if df.loc[i, 'hour'] < 0:
-            if df.loc[i, 'day'] == 1.0:
-                if df.loc[i, 'month'] == 1:
-                    df.loc[i, 'month'] = 12.
-                    df.loc[i, 'year'] = df.loc[i, 'year'] - 1
-                    df.loc[i, 'day'] = days_of_month[12.]
-                else:    
-                    month = df.loc[i, 'month'] - 1
-                    df.loc[i, 'month'] = month
-                    df.loc[i, 'day'] = days_of_month[month]
-            else:
-                df.loc[i, 'day'] -= 1
-            df.loc[i, 'hour'] += 24.  
-
-def create_hex_grid(df: pd.DataFrame, region, xpos, ypos, style, projection, ncolumns: int = 4, nrows: int = 5, scale: float = 1.) -> Tuple[List[List[int]], List[float]]:
+    negative = df['hour'] < 0
+    dates = pd.to_datetime(df.loc[negative, ['year', 'month', 'day']].astype(int)) - pd.Timedelta(days = 1)
+    df.loc[negative, 'year'] = dates.dt.year
+    df.loc[negative, 'month'] = dates.dt.month
+    df.loc[negative, 'day'] = dates.dt.day
+    df.loc[negative, 'hour'] += 24.
+
+def create_hex_grid(df: pd.DataFrame, region, xpos, ypos, style, projection, ncolumns: int = 4, nrows: int = 5, scale: float = 1., binning: str = 'hexagonal', headless: bool = False, profiler: instr.Profiler = None, grid_image: str = 'Hexagonal_Grid_wTCs.png', show: bool = True) -> Tuple[hex_grid.HexGrid, List[List[float]]]:
     """
     Parameters:
         df (pd DataFrame): latitude and longitude of TCs with its induced precipitation 
@@ -91,50 +256,181 @@ def create_hex_grid(df: pd.DataFrame, region, xpos, ypos, style, projection, nco
         ncolumns (integer): number of columns of the grid
         nrows (integer): number of rows of the grid
         scale (float): double size of the hexagon apotheme
+        binning (str): 'hexagonal' bins all TCs in one vectorized pass (bin_points), 'polygon' tests every hexagon polygon (polygon_points)
+        headless (boolean): if True the grid is not plotted
+        profiler (instrumentation.Profiler): measures the binning and plotting stages, None disables it
+        grid_image (str): path of the image of the grid
+        show (boolean): if True the image of the grid is opened in an external viewer
         
     Process:
-        Organization of the hexagonal grid, calls the functions make_grid, create_grid_matrix and plot_HexGrid
+        Organization of the hexagonal grid, calls the functions make_grid, bin_points or polygon_points and plot_HexGrid
         
     Return:
-        Tuple with the Matrix (Grid) and its centers
+        Tuple with the grid (hex_grid.HexGrid, its to_matrix method gives the Matrix of pd DataFrame) and its centers
     """
     lat = df['lat']
     lon = df['lon']
     r = scale/np.sqrt(3)
-    grid_matrix = [([0]*(ncolumns) ) for i in range(nrows)]
-    coord_x, coord_y = make_grid(ncolumns, nrows, scale, xpos, ypos)
-    x_cent_aux, y_cent_aux = (coord_x.flat, coord_y.flat)
-    x_cent = [i for i in x_cent_aux]
-    y_cent = [i for i in y_cent_aux]
-    y_cent.reverse()
+    x_cent, y_cent = hex_centers(ncolumns, nrows, scale, xpos, ypos)
     coords = list(zip(x_cent,y_cent))  
-    Matrix = create_grid_matrix(df, coords, grid_matrix,r)
-    plot.plot_HexGrid(region, x_cent, y_cent, r ,lat, lon, style, projection)
-    return (Matrix, [x_cent, y_cent]) 
+    with instr.stage(profiler, 'bin_grid', binning = binning, points = len(df), hexagons = ncolumns*nrows):
+        if binning == 'polygon':
+            points, cells = polygon_points(df, coords, r, ncolumns, nrows)
+        else:
+            points, cells = bin_points(df, coords, r, scale, xpos, ypos, ncolumns, nrows)
+        Grid = hex_grid.from_points(df, points, cells, ncolumns, nrows)
+    if not headless:
+        with instr.stage(profiler, 'plot_grid'):
+            plot.plot_HexGrid(region, x_cent, y_cent, r ,lat, lon, style, projection, grid_image, show)
+    return (Grid, [x_cent, y_cent]) 
 
-def create_grid_matrix(df: pd.DataFrame,  centers: List[Tuple[float]], Matrix: List[List[int]],r) -> List[List[pd.DataFrame]]:
+def polygon_points(df: pd.DataFrame, centers: List[Tuple[float]], r, ncolumns: int, nrows: int) -> Tuple[np.ndarray, np.ndarray]:
     """
     Parameters:
         df (pd DataFrame): latitude and longitude of TCs with its induced precipitation 
         centers (List of tuple of floats): List with the hexgonal grids centers 
-        Matrix (List of List of integer): Abstract representation of the hexagonal grid
+        r (float): radius of the hexagons
+        ncolumns (integer): number of columns of the grid
+        nrows (integer): number of rows of the grid
 
     Process:
-        Determines which TCs are inside each hexagon
+        Determines which TCs are inside each hexagon testing every hexagon polygon
         
     Return:
-        Matrix (List of List of pd DataFrame) with the corresponding TCs inside the hexagons and precipitation
+        Tuple with the rows of df inside the hexagons and the positions (row*ncolumns + column) of their hexagons, sorted by position
     """
-    nrows = len(Matrix[0]) 
-    lats, lons = (df['lat'],df['lon'])
-    points = list(zip(lons,lats))
-    for pos in range(len(centers)):
+    import matplotlib.path as mpltPath
+    points = list(zip(df['lon'],df['lat']))
+    inside_points, cells = ([], [])
+    for pos in range(nrows*ncolumns):
         V = plot.vertices(centers[pos][0], centers[pos][1], r)
-        polygon = list(zip(V[0],V[1]))
-        path = mpltPath.Path(polygon)    
-        inside = path.contains_points(points)
-        Matrix[pos//nrows][pos%nrows] = df[inside]
-    return Matrix
+        inside = np.flatnonzero(mpltPath.Path(list(zip(V[0],V[1]))).contains_points(points))
+        inside_points.append(inside)
+        cells.append(np.full(len(inside), pos, dtype = np.int64))
+    return np.concatenate(inside_points), np.concatenate(cells)
+
+def hex_cells(lons: np.ndarray, lats: np.ndarray, ncolumns: int, nrows: int, scale: float, xpos, ypos) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parameters:
+        lons (np array): longitude coordinates of the points
+        lats (np array): latitude coordinates of the points
+        ncolumns (integer): number of columns of the grid
+        nrows (integer): number of rows of the grid
+        scale (float): double size of the hexagon apotheme
+        xpos (float): longitude coordinate of the lower left corner hexagon of the grid
+        ypos (float): latitude coordinate of the lower left corner hexagon of the grid
+        
+    Process:
+        Finds the hexagon of every point with the geometry of make_grid. The points are converted to axial hexagonal
+        coordinates (rows of the Matrix go from top to bottom and odd rows are shifted half a hexagon to the left) and
+        rounded to the nearest hexagon center. All inputs broadcast against each other
+        
+    Return:
+        Tuple with the Matrix row, the Matrix column and the hexagonal distance to the center of every point
+        (below 1 inside the hexagon and 1 on its edges). Rows and columns out of the grid are not clipped
+    """
+    ratio = np.sqrt(3) / 2
+    x0 = xpos + np.where(np.asarray(nrows)%2 == 0, scale/2, 0.) #center of Matrix[0][0]
+    y0 = ypos + (np.asarray(nrows) - 1)*ratio*scale
+    u = (lons - x0)/scale
+    v = (y0 - lats)/scale
+    q_frac = u - v/np.sqrt(3)
+    r_frac = v/ratio
+    s_frac = -q_frac - r_frac
+    q, r, s = (np.rint(q_frac), np.rint(r_frac), np.rint(s_frac))
+    dq, dr, ds = (np.abs(q - q_frac), np.abs(r - r_frac), np.abs(s - s_frac))
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    q = np.where(fix_q, -r - s, q)
+    r = np.where(fix_r, -q - s, r)
+    du = u - (q + r/2)
+    dv = v - ratio*r
+    distance = 2*np.maximum(np.abs(du), np.maximum(np.abs(du/2 + ratio*dv), np.abs(du/2 - ratio*dv)))
+    rows = r.astype(np.int64)
+    columns = q.astype(np.int64) + (rows + (rows & 1))//2
+    return rows, columns, distance
+
+def edge_cells(lons: np.ndarray, lats: np.ndarray, edge: np.ndarray, rows: np.ndarray, columns: np.ndarray, centers: List[Tuple[float]], r, ncolumns: int, nrows: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parameters:
+        lons (np array): longitude coordinates of the points
+        lats (np array): latitude coordinates of the points
+        edge (np array): indices of the points lying on a hexagon edge
+        rows (np array): Matrix row of every point (hex_cells)
+        columns (np array): Matrix column of every point (hex_cells)
+        centers (List of tuple of floats): List with the hexgonal grids centers 
+        r (float): radius of the hexagons
+        ncolumns (integer): number of columns of the grid
+        nrows (integer): number of rows of the grid
+        
+    Process:
+        Tests the edge points against the polygons of the hexagons around them, as polygon_points does
+        
+    Return:
+        Tuple with the indices of the points and the positions (row*ncolumns + column) of the hexagons containing them
+    """
+    import matplotlib.path as mpltPath
+    edge_points, edge_positions = ([], [])
+    for point in edge:
+        for i in range(max(rows[point] - 1, 0), min(rows[point] + 2, nrows)):
+            for j in range(max(columns[point] - 1, 0), min(columns[point] + 2, ncolumns)):
+                V = plot.vertices(centers[i*ncolumns + j][0], centers[i*ncolumns + j][1], r)
+                if mpltPath.Path(list(zip(V[0],V[1]))).contains_point((lons[point], lats[point])):
+                    edge_points.append(point)
+                    edge_positions.append(i*ncolumns + j)
+    return np.array(edge_points, dtype = np.int64), np.array(edge_positions, dtype = np.int64)
+
+def bin_points(df: pd.DataFrame, centers: List[Tuple[float]], r, scale: float, xpos, ypos, ncolumns: int, nrows: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parameters:
+        df (pd DataFrame): latitude and longitude of TCs with its induced precipitation 
+        centers (List of tuple of floats): List with the hexgonal grids centers 
+        r (float): radius of the hexagons
+        scale (float): double size of the hexagon apotheme
+        xpos (float): longitude coordinate of the lower left corner hexagon of the grid
+        ypos (float): latitude coordinate of the lower left corner hexagon of the grid
+        ncolumns (integer): number of columns of the grid
+        nrows (integer): number of rows of the grid
+
+    Process:
+        Determines which TCs are inside each hexagon in one pass over the points (hex_cells). Points outside the grid are
+        discarded, and the few points lying on a hexagon edge are tested against the polygons of the neighbouring
+        hexagons, so the result is the same as polygon_points
+        
+    Return:
+        Tuple with the rows of df inside the hexagons and the positions (row*ncolumns + column) of their hexagons, sorted by position
+    """
+    rows, columns, distance = hex_cells(df['lon'].to_numpy(dtype = float), df['lat'].to_numpy(dtype = float), ncolumns, nrows, scale, xpos, ypos)
+    edge = np.abs(distance - 1) < 1e-9
+    keep = ~edge & (rows >= 0) & (rows < nrows) & (columns >= 0) & (columns < ncolumns)
+    points = [np.flatnonzero(keep)]
+    cells = [rows[keep]*ncolumns + columns[keep]]
+    if edge.any():
+        edge_points, edge_positions = edge_cells(df['lon'].to_numpy(dtype = float), df['lat'].to_numpy(dtype = float), np.flatnonzero(edge), rows, columns, centers, r, ncolumns, nrows)
+        points.append(edge_points)
+        cells.append(edge_positions)
+    points, cells = (np.concatenate(points), np.concatenate(cells))
+    order = np.lexsort((points, cells))
+    return points[order], cells[order]
+
+def hex_centers(ncolumns: int, nrows: int, scale: float, xpos, ypos) -> Tuple[List[float], List[float]]:
+    """
+    Parameters:
+        ncolumns (integer): number of columns of the grid
+        nrows (integer): number of rows of the grid
+        scale (float): double size of the hexagon apotheme
+        xpos (float): longitude coordinate of the lower left corner hexagon of the grid
+        ypos (float): latitude coordinate of the lower left corner hexagon of the grid
+        
+    Return:
+        Tuple with the x and y centers of all hexagons, in the order of the Matrix positions (row*ncolumns + column)
+    """
+    coord_x, coord_y = make_grid(ncolumns, nrows, scale, xpos, ypos)
+    x_cent_aux, y_cent_aux = (coord_x.flat, coord_y.flat)
+    x_cent = [i for i in x_cent_aux]
+    y_cent = [i for i in y_cent_aux]
+    y_cent.reverse()
+    return x_cent, y_cent
 
 def make_grid(ncolumns: int, nrows: int, scale: float, xpos , ypos) -> Tuple[float]:
     """
@@ -154,10 +450,10 @@ def make_grid(ncolumns: int, nrows: int, scale: float, xpos , ypos) -> Tuple[flo
     ratio = np.sqrt(3) / 2
     coord_x, coord_y = np.meshgrid(np.arange(0 , ncolumns), np.arange(0 , nrows), sparse=False, indexing='xy')
     coord_y = coord_y * ratio
-    coord_x = coord_x.astype(np.float)
+    coord_x = coord_x.astype(float)
     coord_x[1::2, :] -= 0.5
     coord_x *= scale 
-    coord_y = coord_y.astype(np.float) * scale
+    coord_y = coord_y.astype(float) * scale
     if nrows%2 == 0:
         coord_x += xpos + scale/2 
     else:
@@ -168,11 +464,129 @@ def make_grid(ncolumns: int, nrows: int, scale: float, xpos , ypos) -> Tuple[flo
     return coord_x, coord_y
 
 
-def get_probabilities(df: pd.DataFrame, Thresholds: pd.DataFrame) -> pd.DataFrame: #df lluvias de ciclones, umbrales 
+def station_probabilities(station_data: np.ndarray, thresholds: List[float], plot_fit: bool = True, cache_dir: str = None) -> Tuple[str, np.ndarray, int]:
+    """
+    Parameters:
+        station_data (np array): Induced precipitation data of one station
+        thresholds (List of floats): Green, yellow and red thresholds of the station
+        plot_fit (boolean): if True the empirical and theoretical distributions are plotted
+        cache_dir (str): directory of the fit cache, None disables it
+        
+    Process:
+        Finds the best fit for the induced precipitation data of one station and computes its probabilities of extreme precipitation
+        
+    Return:
+        Tuple with the name of the fitted distribution, the probabilities (%) of exceeding each threshold and the number of distributions tried
+    """
+    name, params, candidates = fit_distribution(station_data, 'popular', smooth = 10, cache_dir = cache_dir, plot_fit = plot_fit)
+    *parametros, loc, scale =  params
+    probabilities_VNR = np.round(100*(1-cache.distribution(name).cdf(thresholds, *parametros, loc = loc, scale = scale)),2)
+    return name, probabilities_VNR, candidates
+
+def empirical_probabilities(array: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """
+    Parameters:
+        array (np array): Induced precipitation data of one hexagon, one column per station
+        thresholds (np array): Green, Yellow and Red thresholds of each station, one row per column of array
+        
+    Process:
+        Compares every sample of every station with its three thresholds at once. Missing values (NaN) are left out
+        of both the exceedances and the number of samples of their station
+        
+    Return:
+        np array with the probabilities (%) of exceeding each threshold, one row per station, NaN for stations without data
+    """
+    array = np.asarray(array, dtype = float)
+    thresholds = np.asarray(thresholds, dtype = float)
+    exceedances = (array[:, :, None] > thresholds[None, :, :]).sum(axis = 0) #NaN never exceeds
+    samples = np.count_nonzero(~np.isnan(array), axis = 0)[:, None]
+    probabilities = np.divide(100.*exceedances, samples, out = np.full(exceedances.shape, np.nan), where = samples > 0)
+    return np.round(probabilities, 2)
+
+def bootstrap_intervals(array: np.ndarray, thresholds: np.ndarray, replicates: int = 1000, confidence: float = CONFIDENCE, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parameters:
+        array (np array): Induced precipitation data of one hexagon, one column per station
+        thresholds (np array): Green, Yellow and Red thresholds of each station, one row per column of array
+        replicates (int): number of bootstrap replicates
+        confidence (float): confidence level of the intervals
+        seed (int): seed of the random generator, so the intervals of a hexagon are the same in every run
+        
+    Process:
+        Draws all replicates at once as a (replicates, samples) matrix of row indices, turns it into the number of times
+        every sample is drawn in each replicate, and gets the exceedances and sample sizes of every replicate, station and
+        alert level with two matrix products. Missing values (NaN) are left out as in empirical_probabilities
+        
+    Return:
+        Tuple with the lower and upper percentile bounds (%) of the probability of exceeding each threshold, one row per station
+    """
+    array = np.asarray(array, dtype = float)
+    thresholds = np.asarray(thresholds, dtype = float)
+    nsamples, nstations = array.shape
+    rng = np.random.default_rng(seed)
+    draws = rng.integers(0, nsamples, (replicates, nsamples))
+    draws += nsamples*np.arange(replicates)[:, None]
+    weights = np.bincount(draws.ravel(), minlength = replicates*nsamples).reshape(replicates, nsamples).astype(float)
+    exceedances = weights @ (array[:, :, None] > thresholds[None, :, :]).reshape(nsamples, -1)
+    samples = np.repeat(weights @ ~np.isnan(array), thresholds.shape[1], axis = 1)
+    probabilities = np.divide(100.*exceedances, samples, out = np.full(exceedances.shape, np.nan), where = samples > 0)
+    tail = 50*(1 - confidence)
+    if np.isnan(probabilities).any():
+        low, high = np.nanpercentile(probabilities, [tail, 100 - tail], axis = 0)
+    else:
+        low, high = np.percentile(probabilities, [tail, 100 - tail], axis = 0)
+    shape = (nstations, thresholds.shape[1])
+    return np.round(low.reshape(shape), 2), np.round(high.reshape(shape), 2)
+
+def add_intervals(dataframe: pd.DataFrame, df: pd.DataFrame, Thresholds: pd.DataFrame, replicates: int, confidence: float = CONFIDENCE) -> pd.DataFrame:
+    """
+    Parameters:
+        dataframe (pd DataFrame): probabilities of all stations of one hexagon, as returned by get_probabilities
+        df (np array or pd DataFrame): Induced precipitation data of the hexagon, one column per station
+        Thresholds (pd DataFrame): Thresholds of each stations
+        replicates (int): number of bootstrap replicates
+        confidence (float): confidence level of the intervals
+        
+    Process:
+        The intervals are percentile bootstrap intervals of the exceedance frequency (bootstrap_intervals), so they only describe
+        probabilities computed with the 'empirical' estimator
+        
+    Return:
+        pd DataFrame with the bootstrap interval of every probability added ('%Green_low', '%Green_high', ...)
+    """
+    low, high = bootstrap_intervals(np.asarray(df, dtype = float)[:, Thresholds.index], Thresholds[['Green','Yellow','Red']].to_numpy(), replicates, confidence)
+    dataframe = dataframe.copy()
+    for k, alerta in enumerate(plot.ALERT_LABELS):
+        dataframe[f'%{alerta}_low'] = low[:, k]
+        dataframe[f'%{alerta}_high'] = high[:, k]
+    return dataframe
+
+def check_estimator(estimator: str, bootstrap: int = 0) -> None:
+    """
+    Parameters:
+        estimator (str): estimator of the probabilities
+        bootstrap (int): number of bootstrap replicates of the intervals, 0 if they are not computed
+
+    Process:
+        Raises a ValueError if the estimator is not one of ESTIMATORS, so a misspelled name does not silently run distfit, or if
+        bootstrap intervals are asked for with an estimator other than 'empirical'
+    """
+    if estimator not in ESTIMATORS:
+        raise ValueError(f"unknown estimator {estimator!r}, use one of {', '.join(map(repr, ESTIMATORS))}")
+    if bootstrap > 0 and estimator != 'empirical':
+        raise ValueError("bootstrap intervals are intervals of the empirical exceedance frequency, use them with estimator = 'empirical'")
+
+def get_probabilities(df: pd.DataFrame, Thresholds: pd.DataFrame, cache_dir: str = None, headless: bool = False, profiler: instr.Profiler = None, hexagon: Tuple[int, int] = None, estimator: str = 'distfit') -> pd.DataFrame: #df lluvias de ciclones, umbrales 
     """
     Parameters:
-        df (pd DataFrame): Induced precipitation data of one hexagon
+        df (np array or pd DataFrame): Induced precipitation data of one hexagon, one column per station
         Thresholds (pd DataFrame): Thresholds of each stations
+        cache_dir (str): directory of the fit cache, None disables it
+        headless (boolean): if True the fitted distributions are not plotted
+        profiler (instrumentation.Profiler): records the time, distribution and candidates of every fit, None disables it
+        hexagon (Tuple of integers): position of the hexagon in the grid, saved with the fit records
+        estimator (str): 'distfit' fits a distribution to every station, 'empirical' counts the exceedances of all stations
+                         at once (empirical_probabilities), its distribution column is 'empirical'
         
     Process:
         Finds the best fit for the induced precipitation data and computes extreme precipitation according to the Thresholds
@@ -180,56 +594,226 @@ def get_probabilities(df: pd.DataFrame, Thresholds: pd.DataFrame) -> pd.DataFram
     Return:
         pd DataFrame containing probabilities of all stations due to TCs located in a specific hexagon
     """
+    check_estimator(estimator)
+    array = np.asarray(df)  
+    if estimator == 'empirical':
+        probabilities = empirical_probabilities(array[:, Thresholds.index], Thresholds[['Green','Yellow','Red']].to_numpy())
+        dataframe = pd.DataFrame(probabilities, columns = ['%Green', '%Yellow', '%Red'])
+        dataframe.insert(0, 'distribution', 'empirical')
+        dataframe.insert(0, 'ID', Thresholds['ID'].to_numpy())
+        return dataframe
     Resultados = []
     for i in Thresholds.index:
-        array = df.to_numpy()  
         station_data = array[:,i]
-        dist = distfit(distr = 'popular',smooth=10)
-        dist.fit_transform(station_data)
-        *parametros, loc, scale =  dist.model['params']
-        dist.plot() #Plot of the empirical and theoretical distributions
-        probabilities_VNR = np.round(100*(1-dist.model['distr'].cdf(list(Thresholds.loc[i,['Green','Yellow','Red']]), *parametros, loc = loc, scale = scale)),2)
-        Resultados.append([Thresholds['ID'].loc[i], dist.model['name'] ,*probabilities_VNR]) 
+        start = time.perf_counter() if profiler is not None else None
+        name, probabilities_VNR, candidates = station_probabilities(station_data, list(Thresholds.loc[i,['Green','Yellow','Red']]), plot_fit = not headless, cache_dir = cache_dir)
+        if profiler is not None:
+            profiler.record_fit(hexagon = hexagon, station = Thresholds['ID'].loc[i], seconds = time.perf_counter() - start, distribution = name, candidates = candidates)
+        Resultados.append([Thresholds['ID'].loc[i], name ,*probabilities_VNR]) 
     dataframe = pd.DataFrame(Resultados, columns = ['ID', 'distribution' , '%Green', '%Yellow', '%Red'])
     return dataframe  
 
-def Probs_grid(grid: List[List[pd.DataFrame]], centers: List[List[float]], Thresholds: pd.DataFrame, stations, region, style, projection, savedir) -> None:
+def _init_fit_worker(shm_name: str, shape: Tuple[int], dtype: str) -> None:
     """
     Parameters:
-        grid (List of List of pd DataFrame): Induced precipitation data of one hexagon
-        centers (List of List of floats):  List containing the latitude and longitude coordinate of the hexagon centers in a list
+        shm_name (str): name of the shared memory block holding the induced precipitation of all hexagons
+        shape (Tuple of integers): shape of the shared array
+        dtype (str): data type of the shared array
+        
+    Process:
+        Attaches a worker process to the shared precipitation array, without copying it
+    """
+    global _shared_precipitation
+    shm = shared_memory.SharedMemory(name = shm_name)
+    _shared_precipitation = (shm, np.ndarray(shape, dtype = dtype, buffer = shm.buf))
+
+def _fit_task(task: Tuple[int, int, int, List[float], str]) -> Tuple[str, np.ndarray, int, float]:
+    """
+    Parameters:
+        task (Tuple): first and last row of the hexagon in the shared array, station column, station thresholds and fit cache directory
+        
+    Return:
+        Tuple with the name of the fitted distribution, the probabilities (%) of exceeding each threshold, the number of
+        distributions tried and the time of the fit in seconds
+    """
+    start, stop, column, thresholds, cache_dir = task
+    station_data = _shared_precipitation[1][start:stop, column]
+    clock = time.perf_counter()
+    name, probabilities_VNR, candidates = station_probabilities(station_data, thresholds, plot_fit = False, cache_dir = cache_dir)
+    return name, probabilities_VNR, candidates, time.perf_counter() - clock
+
+def parallel_probabilities(blocks: List[pd.DataFrame], Thresholds: pd.DataFrame, n_workers: int, cache_dir: str = None, profiler: instr.Profiler = None, hexagons: List[Tuple[int, int]] = None):
+    """
+    Parameters:
+        blocks (List of np array or pd DataFrame): Induced precipitation data of each hexagon
+        Thresholds (pd DataFrame): Thresholds of each stations
+        n_workers (int): number of worker processes
+        cache_dir (str): directory of the fit cache, None disables it
+        profiler (instrumentation.Profiler): records the time, distribution and candidates of every fit, None disables it
+        hexagons (List of Tuple of integers): position in the grid of every block, saved with the fit records
+        
+    Process:
+        Fits every (hexagon, station) pair as an independent task in a process pool. The precipitation of all hexagons is
+        stacked in one shared memory array that the workers read from, and results are gathered in submission order
+        
+    Return:
+        Generator of pd DataFrame with the probabilities of all stations, one per hexagon and in the same order as blocks
+    """
+    arrays = [np.asarray(block, dtype = float) for block in blocks]
+    offsets = np.cumsum([0] + [array.shape[0] for array in arrays])
+    stacked = np.concatenate(arrays)
+    thresholds = {i: list(Thresholds.loc[i,['Green','Yellow','Red']]) for i in Thresholds.index}
+    tasks = [(offsets[k], offsets[k+1], i, thresholds[i], cache_dir) for k in range(len(arrays)) for i in Thresholds.index]
+    shm = shared_memory.SharedMemory(create = True, size = stacked.nbytes)
+    try:
+        np.ndarray(stacked.shape, dtype = stacked.dtype, buffer = shm.buf)[:] = stacked
+        del stacked
+        with ProcessPoolExecutor(max_workers = n_workers, initializer = _init_fit_worker, initargs = (shm.name, (offsets[-1], arrays[0].shape[1]), arrays[0].dtype.str)) as executor:
+            results = executor.map(_fit_task, tasks, chunksize = max(1, len(tasks)//(4*n_workers)))
+            for k in range(len(arrays)):
+                Resultados = []
+                for i in Thresholds.index:
+                    name, probabilities_VNR, candidates, seconds = next(results)
+                    if profiler is not None:
+                        profiler.record_fit(hexagon = hexagons[k] if hexagons else k, station = Thresholds['ID'].loc[i], seconds = seconds, distribution = name, candidates = candidates)
+                    Resultados.append([Thresholds['ID'].loc[i], name ,*probabilities_VNR])
+                yield pd.DataFrame(Resultados, columns = ['ID', 'distribution' , '%Green', '%Yellow', '%Red'])
+    finally:
+        shm.close()
+        shm.unlink()
+
+def hexagon_key(block: pd.DataFrame, Thresholds: pd.DataFrame, estimator: str = 'distfit', bootstrap: int = 0, confidence: float = CONFIDENCE) -> str:
+    """
+    Parameters:
+        block (np array or pd DataFrame): Induced precipitation data of one hexagon
+        Thresholds (pd DataFrame): Thresholds of each stations
+        estimator (str): estimator of the probabilities ('distfit' or 'empirical')
+        bootstrap (int): number of bootstrap replicates of the intervals, 0 if they are not computed
+        confidence (float): confidence level of the intervals
+        
+    Return:
+        Hexadecimal hash identifying the probabilities of one hexagon: its data, the thresholds and the estimator settings
+    """
+    check_estimator(estimator)
+    distr, smooth = ('empirical', None) if estimator == 'empirical' else ('popular', 10)
+    digest = hashlib.sha256(cache.sample_key(np.asarray(block, dtype = float), distr, smooth).encode())
+    digest.update(Thresholds[['ID','Green','Yellow','Red']].to_json().encode())
+    if bootstrap > 0:
+        digest.update(f'bootstrap {bootstrap} {confidence}'.encode())
+    return digest.hexdigest()
+
+def read_checkpoint(path: str) -> dict:
+    """
+    Parameters:
+        path (str): checkpoint file written by Probs_grid
+        
+    Return:
+        Dictionary with the probabilities (pd DataFrame) of every finished hexagon, by hexagon_key. A last line left
+        incomplete by an interrupted run is ignored and cut from the file, so the entries appended when resuming start
+        on a new line
+    """
+    finished = {}
+    if not os.path.exists(path):
+        return finished
+    with open(path, 'rb+') as file:
+        data = file.read()
+        complete = data.rfind(b'\n') + 1
+        if complete < len(data):
+            file.truncate(complete)
+            file.flush()
+            os.fsync(file.fileno())
+    for line in data[:complete].decode().splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        finished[entry['key']] = pd.DataFrame(entry['data'], columns = entry['columns'])
+    return finished
+
+def append_checkpoint(file, key: str, probabilities_df: pd.DataFrame) -> None:
+    """
+    Parameters:
+        file (file object): checkpoint file opened in append mode
+        key (str): hexagon_key of the hexagon
+        probabilities_df (pd DataFrame): probabilities of all stations due to TCs located in the hexagon
+        
+    Process:
+        Writes the hexagon results as one json line and forces it to disk
+    """
+    entry = json.loads(probabilities_df.to_json(orient = 'split', index = False, double_precision = 15))
+    file.write(json.dumps({'key': key, 'columns': entry['columns'], 'data': entry['data']}) + '\n')
+    file.flush()
+    os.fsync(file.fileno())
+
+def Probs_grid(grid: hex_grid.HexGrid, centers: List[List[float]], Thresholds: pd.DataFrame, stations, region, style, projection, savedir, n_workers: int = 1, cache_dir: str = None, headless: bool = False, dpi: int = 650, img_format: str = 'png', resume: bool = False, results_path: str = 'computed_probabilities.csv', profiler: instr.Profiler = None, estimator: str = 'distfit', bootstrap: int = 0, manifest_path: str = 'render_manifest.json', confidence: float = CONFIDENCE) -> None:
+    """
+    Parameters:
+        grid (hex_grid.HexGrid): Induced precipitation data of every hexagon, as returned by create_hex_grid
+        centers (List of List of floats):  List containing the longitude and latitude coordinate of the hexagon centers in a list
         Thresholds (pd DataFrame): Thresholds data
         stations (pd Dataframe): stations locations data
         region (List of floats): min/max longitude and latitude coordinates to define the region that shows the stations
         style (str): Marker and size of the scatter plot for the stations
         projection (str): projection and size of the image for the stations plot
         savedir (str): directory where you wish to save the final image results
+        n_workers (int): number of processes used to fit the distributions and render the images, 1 runs serially
+        cache_dir (str): directory of the fit cache, None disables it
+        headless (boolean): if True no plots are made, only the probabilities and the render manifest are computed and saved
+        dpi (int): resolution of the images
+        img_format (str): format of the images (png, jpg, pdf...)
+        resume (boolean): if True the hexagons found in the checkpoint of a previous run with the same inputs are not computed again
+        results_path (str): path of the .csv file with the computed probabilities, the checkpoint is saved next to it (.checkpoint)
+        profiler (instrumentation.Profiler): measures the fitting, writing and rendering stages and records every hexagon and fit, None disables it
+        estimator (str): 'distfit' fits a distribution to every station, 'empirical' counts the exceedances of all stations at once,
+                         which is fast enough to always run serially
+        bootstrap (int): number of bootstrap replicates used to add the confidence interval of every probability to the
+                         results (add_intervals), 0 does not compute them. The intervals are those of the exceedance frequency,
+                         so they are only available with the 'empirical' estimator
+        manifest_path (str): path of the render manifest of the images
+        confidence (float): confidence level of the bootstrap intervals
     Process:
-        Analayze all hexagons and make a graphical result of probabilities in all stations. Saves the computed probabilities in a .csv file
+        Analayze all hexagons and make a graphical result of probabilities in all stations. Every finished hexagon is appended
+        to the checkpoint file, and the computed probabilities are saved in a .csv file at the end together with the render
+        manifest of the images (manifest_path). The images are rendered after all probabilities are computed
     """
+    check_estimator(estimator, bootstrap)
     x_centers, y_centers = (centers[0],centers[1])
-    ncolumns = len(grid[0])
-    x_centers_par = x_centers[0:ncolumns]
-    x_centers_impar = x_centers[ncolumns:2*ncolumns]
-    y_centers = y_centers[0:-1:ncolumns]    
-    probs_results = pd.DataFrame(columns = ['Hex_lat', 'Hex_long', 'ID', 'distribution' , '%Green', '%Yellow', '%Red']) 
-    for i in range(0,len(grid)): 
-        for j in range(0,len(grid[0])): 
-            if grid[i][j].shape[0] < 7:
-                continue
-            else:    
-                print(i,j)
-                if i%2 == 0:  
-                    probabilities_df = get_probabilities(grid[i][j].drop(columns=['lat','lon']), Thresholds)
-                    hex_loc_df = pd.DataFrame([[x_centers_par[j], y_centers[i]]],columns = ['Hex_lat', 'Hex_long'])
-                    probs_results_aux = pd.concat([hex_loc_df, probabilities_df])
-                    probs_results = pd.concat([probs_results, probs_results_aux])
-                    plot.make_figures(probabilities_df, x_centers_par[j], y_centers[i], stations, region, style, projection, savedir)
-                else:
-                    probabilities_df = get_probabilities(grid[i][j].drop(columns=['lat','lon']), Thresholds)
-                    hex_loc_df = pd.DataFrame([[x_centers_impar[j], y_centers[i]]],columns = ['Hex_lat', 'Hex_long'])
-                    probs_results_aux = pd.concat([hex_loc_df, probabilities_df])
-                    probs_results = pd.concat([probs_results, probs_results_aux])
-                    plot.make_figures(probabilities_df, x_centers_impar[j], y_centers[i], stations, region, style, projection, savedir)
-    probs_results.to_csv('computed_probabilities.csv') 
-    
+    positions = grid.populated(MIN_SAMPLES)
+    hexagons = [divmod(pos, grid.ncolumns) for pos in positions]
+    blocks = [grid.block(pos) for pos in positions] #views of the grid precipitation, nothing is copied
+    keys = [hexagon_key(block, Thresholds, estimator, bootstrap, confidence) for block in blocks]
+    checkpoint_path = f'{results_path}.checkpoint'
+    finished = read_checkpoint(checkpoint_path) if resume else {}
+    pending = [k for k in range(len(hexagons)) if keys[k] not in finished]
+    if n_workers > 1 and pending and estimator != 'empirical':
+        probabilities = parallel_probabilities([blocks[k] for k in pending], Thresholds, n_workers, cache_dir, profiler, [hexagons[k] for k in pending])
+    else:
+        probabilities = (get_probabilities(blocks[k], Thresholds, cache_dir, headless, profiler, hexagons[k], estimator) for k in pending)
+    with instr.stage(profiler, 'fit_probabilities', hexagons = len(pending), stations = len(Thresholds), n_workers = n_workers, estimator = estimator):
+        with open(checkpoint_path, 'a' if resume else 'w') as checkpoint:
+            clock = time.perf_counter()
+            for probabilities_df, k in zip(probabilities, pending):
+                if profiler is not None:
+                    profiler.record_hexagon(hexagon = hexagons[k], samples = len(blocks[k]), seconds = time.perf_counter() - clock)
+                if bootstrap > 0:
+                    probabilities_df = add_intervals(probabilities_df, blocks[k], Thresholds, bootstrap, confidence)
+                append_checkpoint(checkpoint, keys[k], probabilities_df)
+                finished[keys[k]] = probabilities_df
+                clock = time.perf_counter()
+    if cache_dir is not None:
+        cache.prune(cache_dir)
+    rendered_hexagons = []
+    columns = ['Hex_lat', 'Hex_long', 'ID', 'distribution' , '%Green', '%Yellow', '%Red']
+    if hexagons:
+        columns = ['Hex_lat', 'Hex_long'] + list(finished[keys[0]].columns)
+    with instr.stage(profiler, 'write_results'):
+        with open(results_path, 'w', newline = '') as results:
+            pd.DataFrame(columns = columns).to_csv(results)
+            for pos, key in zip(positions, keys):
+                hex_loc_df = pd.DataFrame([[x_centers[pos], y_centers[pos]]],columns = ['Hex_lat', 'Hex_long'])
+                pd.concat([hex_loc_df, finished[key]]).reindex(columns = columns).to_csv(results, header = False)
+                rendered_hexagons.append((x_centers[pos], y_centers[pos], finished[key]))
+        plot.write_render_manifest(manifest_path, rendered_hexagons, stations, region, style, projection, savedir)
+    if not headless:
+        with instr.stage(profiler, 'render_figures', maps = 3*len(rendered_hexagons)):
+            plot.render_figures(manifest_path, n_workers, dpi, img_format)
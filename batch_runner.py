@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import argparse
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+import auxiliar_functions as aux
+import data_loader as loader
+import instrumentation as instr
+import plot_functions as plot
+
+SCENARIO_DEFAULTS = {'compute_probs': True, 'hour_correction': 0, 'style_grid': "c0.075c", 'style_stations': "c0.15c", 'projection_grid': "M17.5c",
+                     'projection_stations': "M15c", 'n_workers': 1, 'binning': 'hexagonal', 'headless': True, 'dpi': 650, 'img_format': 'png',
+                     'resume': False, 'estimator': 'distfit', 'bootstrap': 0, 'confidence': aux.CONFIDENCE, 'stations': None, 'profile': False}
+
+GRID_MEMO = 2 #grids kept by every process for the next scenarios, each one holds a copy of its precipitation rows
+
+_shared = None #inputs and memoized products of the scenarios run by this process
+
+def load_scenarios(path: str) -> Tuple[dict, List[dict]]:
+    """
+    Parameters:
+        path (str): scenario file (.json or .toml) with the batch settings ('output', 'data_period', 'data_cache', 'fit_cache',
+                    'n_workers'), where 'data_period' (the dates of the whole precipitation file) is required, the 'defaults' shared by all scenarios and the list of 'scenarios'. Every scenario takes the
+                    arguments of Tool.main (period, grid_region, location, cols, rows, apt_size, hour_correction...), plus a
+                    'name', the 'stations' IDs to analyze (all if missing) and 'profile' to save a run report
+
+    Return:
+        Tuple with the batch settings and the scenarios, completed with the defaults
+    """
+    name = os.path.basename(path)
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as file:
+            settings = tomllib.load(file)
+    else:
+        with open(path) as file:
+            settings = json.load(file)
+    if 'data_period' not in settings:
+        raise ValueError(f"{name} has no 'data_period': the start and end dates of the whole precipitation file are required, "
+                         "the 'period' of every scenario only selects the TCs dates analyzed")
+    defaults = {**SCENARIO_DEFAULTS, **settings.pop('defaults', {})}
+    scenarios = []
+    for k, scenario in enumerate(settings.pop('scenarios', [])):
+        scenarios.append({'name': f'scenario_{k:03d}', **defaults, **scenario})
+    return settings, scenarios
+
+def load_inputs(data_period: List[str], data_cache: str = None, tcs: bool = True) -> dict:
+    """
+    Parameters:
+        data_period (List of str): start and end dates 'day/month/year' of the precipitation data
+        data_cache (str): directory of the binary copies of the input files, None reads the text files
+        tcs (boolean): if False the TCs data is not loaded
+
+    Return:
+        Dictionary with the precipitation data indexed by date, the stations location, the thresholds and the TCs data
+    """
+    prepc_data = loader.load_precipitation(cache_dir = data_cache)
+    inputs = {'prepc_data': prepc_data.set_index(pd.date_range(start=data_period[0], end=data_period[1])),
+              'station_locations': loader.load_stations(cache_dir = data_cache),
+              'Thresholds': pd.read_csv('thresholds.csv', delimiter = ",")}
+    if tcs:
+        inputs['TCs'] = loader.load_tcs(cache_dir = data_cache)
+    return inputs
+
+def _init_batch_worker(data_period: List[str], data_cache: str, means: dict) -> None:
+    """
+    Parameters:
+        data_period (List of str): start and end dates 'day/month/year' of the precipitation data
+        data_cache (str): directory of the binary copies of the input files, None reads the text files
+        means (dict): daily average positions of the TCs and their dates, by hour_correction
+
+    Process:
+        Loads the inputs once per worker process, memory mapped from data_cache when it is given
+    """
+    global _shared
+    _shared = {**load_inputs(data_period, data_cache, tcs = False), 'means': means, 'grids': OrderedDict()}
+
+def scenario_grid(scenario: dict, outdir: str, profiler: instr.Profiler = None):
+    """
+    Parameters:
+        scenario (dict): settings of the scenario
+        outdir (str): output directory of the scenario
+        profiler (instrumentation.Profiler): measures the binning and plotting stages, None disables it
+
+    Process:
+        Bins the induced precipitation of the TCs of the scenario period. The grid is reused by the next scenarios run by this
+        process with the same period, hour correction and grid. Only the GRID_MEMO most recently used grids are kept, so the
+        memory of a worker does not grow with the number of scenarios. The image of the grid is saved in outdir unless the scenario is headless
+
+    Return:
+        Tuple with the grid (hex_grid.HexGrid) and its centers, as aux.create_hex_grid
+    """
+    key = json.dumps([scenario[name] for name in ['period', 'hour_correction', 'location', 'cols', 'rows', 'apt_size', 'binning']])
+    if key not in _shared['grids']:
+        TCs_means, IR_dates = _shared['means'][scenario['hour_correction']]
+        fechas = pd.date_range(start=scenario['period'][0], end=scenario['period'][1])
+        keep = (IR_dates >= fechas[0]) & (IR_dates <= fechas[-1])
+        TCs_IR_JOIN = pd.concat([TCs_means[keep], _shared['prepc_data'].loc[IR_dates[keep],:]], axis=1)
+        _shared['grids'][key] = aux.create_hex_grid(TCs_IR_JOIN, scenario['grid_region'], scenario['location'][0], scenario['location'][1], scenario['style_grid'],
+                                                    scenario['projection_grid'], scenario['cols'], scenario['rows'], scale = scenario['apt_size'],
+                                                    binning = scenario['binning'], headless = True, profiler = profiler)
+        while len(_shared['grids']) > GRID_MEMO:
+            _shared['grids'].popitem(last = False)
+    _shared['grids'].move_to_end(key)
+    grid, centers = _shared['grids'][key]
+    if not scenario['headless']:
+        with instr.stage(profiler, 'plot_grid'):
+            plot.plot_HexGrid(scenario['grid_region'], centers[0], centers[1], scenario['apt_size']/np.sqrt(3), grid.lat, grid.lon, scenario['style_grid'],
+                              scenario['projection_grid'], os.path.join(outdir, 'Hexagonal_Grid_wTCs.png'), show = False)
+    return grid, centers
+
+def run_scenario(scenario: dict, output: str, fit_cache: str = None) -> dict:
+    """
+    Parameters:
+        scenario (dict): settings of the scenario
+        output (str): output directory of the batch, the scenario writes in its own subdirectory
+        fit_cache (str): directory of the fit cache shared by all scenarios, None disables it
+
+    Process:
+        Runs the steps of Tool.main on the inputs of this process. The probabilities, checkpoint, render manifest, images and
+        run report of the scenario are saved in output/name
+
+    Return:
+        Dictionary with the name, output directory, number of analyzed hexagons and wall time of the scenario
+    """
+    aux.check_estimator(scenario['estimator'], scenario['bootstrap'])
+    outdir = os.path.join(output, scenario['name'])
+    os.makedirs(outdir, exist_ok = True)
+    profiler = instr.Profiler(report_path = os.path.join(outdir, 'run_report.json')) if scenario['profile'] else None
+    start = time.perf_counter()
+    with instr.stage(profiler, 'create_hex_grid'):
+        grid, centers = scenario_grid(scenario, outdir, profiler)
+    Thresholds, station_locations = (_shared['Thresholds'], _shared['station_locations'])
+    if scenario['stations'] is not None:
+        Thresholds = Thresholds[Thresholds['ID'].isin(scenario['stations'])]
+        station_locations = station_locations[station_locations['ID'].isin(scenario['stations'])]
+    if scenario['compute_probs']:
+        with instr.stage(profiler, 'Probs_grid'):
+            aux.Probs_grid(grid, centers, Thresholds, station_locations, scenario['stations_region'], scenario['style_stations'], scenario['projection_stations'],
+                           os.path.join(outdir, 'Images'), scenario['n_workers'], fit_cache, scenario['headless'], scenario['dpi'], scenario['img_format'],
+                           scenario['resume'], os.path.join(outdir, 'computed_probabilities.csv'), profiler, scenario['estimator'], scenario['bootstrap'],
+                           os.path.join(outdir, 'render_manifest.json'), scenario['confidence'])
+    if profiler is not None:
+        profiler.save()
+    return {'name': scenario['name'], 'output': outdir, 'hexagons': len(grid.populated(aux.MIN_SAMPLES)), 'seconds': time.perf_counter() - start}
+
+def _batch_task(scenario: dict, output: str, fit_cache: str = None) -> dict:
+    """
+    Parameters:
+        scenario (dict): settings of the scenario
+        output (str): output directory of the batch
+        fit_cache (str): directory of the fit cache shared by all scenarios, None disables it
+
+    Return:
+        Summary of the scenario (run_scenario), or its name and error if it failed, so one scenario does not stop the batch
+    """
+    try:
+        return run_scenario(scenario, output, fit_cache)
+    except Exception as error:
+        return {'name': scenario['name'], 'output': os.path.join(output, scenario['name']), 'error': repr(error)}
+
+def run_batch(path: str, n_workers: int = None) -> List[dict]:
+    """
+    Parameters:
+        path (str): scenario file (load_scenarios)
+        n_workers (int): number of processes running scenarios, None uses the 'n_workers' of the scenario file (1 by default)
+
+    Process:
+        Loads the inputs and computes the daily average positions of the TCs once for every hour correction, then runs the
+        scenarios over a process pool. The inputs are converted once into data_cache ('data_cache' by default), so every worker
+        memory maps them instead of parsing the text files. The stores hold the same values as the text files, so the results
+        and fit cache entries are the same as Tool.main, and all scenarios share the fit cache. When several scenarios run
+        at once each of them runs serially. A failed scenario is reported with its error and does not stop the others. A summary
+        of the batch is saved in output/batch_summary.json
+
+    Return:
+        List with the summary of every scenario, in the order of the scenario file
+    """
+    global _shared
+    settings, scenarios = load_scenarios(path)
+    output = settings.get('output', 'batch_output')
+    data_cache = settings.get('data_cache', 'data_cache')
+    fit_cache = settings.get('fit_cache', os.path.join(output, 'fit_cache'))
+    n_workers = n_workers or settings.get('n_workers', 1)
+    data_period = settings['data_period']
+    os.makedirs(output, exist_ok = True)
+    inputs = load_inputs(data_period, data_cache)
+    means = {hour_correction: aux.daily_means(inputs['TCs'], hour_correction) for hour_correction in {scenario['hour_correction'] for scenario in scenarios}}
+    if n_workers > 1 and len(scenarios) > 1:
+        scenarios = [{**scenario, 'n_workers': 1} for scenario in scenarios]
+        with ProcessPoolExecutor(max_workers = n_workers, initializer = _init_batch_worker, initargs = (data_period, data_cache, means)) as executor:
+            summary = list(executor.map(_batch_task, scenarios, itertools.repeat(output), itertools.repeat(fit_cache)))
+    else:
+        _shared = {**inputs, 'means': means, 'grids': OrderedDict()}
+        summary = [_batch_task(scenario, output, fit_cache) for scenario in scenarios]
+    with open(os.path.join(output, 'batch_summary.json'), 'w') as file:
+        json.dump(summary, file, indent = 2)
+    return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Runs Tool.main for every scenario of a .json or .toml file, sharing the loaded data')
+    parser.add_argument('scenarios', help = 'scenario file')
+    parser.add_argument('--workers', type = int, default = None, help = 'processes running scenarios, overrides n_workers of the file')
+    args = parser.parse_args()
+    for result in run_batch(args.scenarios, args.workers):
+        if 'error' in result:
+            print(f"{result['name']}: failed with {result['error']}")
+        else:
+            print(f"{result['name']}: {result['hexagons']} hexagons in {result['seconds']:.2f}s -> {result['output']}")
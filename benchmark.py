@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import argparse
+import itertools
+import json
+import os
+import platform
+import tempfile
+import time
+from typing import List
+import numpy as np
+import pandas as pd
+import auxiliar_functions as aux
+import data_loader as loader
+import hex_grid
+import plot_functions as plot
+
+def generate_synthetic_data(directory: str, years: int = 10, stations: int = 50, storms: int = 100, cols: int = 5, rows: int = 4, apt_size: float = 2., location: List[float] = (-90., 10.), start_year: int = 1981, seed: int = 0) -> dict:
+    """
+    Parameters:
+        directory (str): directory where the input files are written
+        years (int): number of years of daily precipitation
+        stations (int): number of stations
+        storms (int): number of TCs
+        cols (int): number of columns of the grid
+        rows (int): numbers of rows of the grid
+        apt_size (float): double of the hexagon apotheme size in degrees
+        location (List of floats): center of the lower left corner hexagon of the grid
+        start_year (int): first year of the data
+        seed (int): seed of the random generator
+
+    Process:
+        Writes precipitation_data.txt, stations_location.txt, thresholds.csv and TCs_data.txt with the layout expected by
+        Tool.main. The TCs are 6-hourly tracks of 3 to 10 days starting inside the grid
+
+    Return:
+        Dictionary with the arguments of Tool.main that match the generated data (period, location, cols, rows, apt_size)
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok = True)
+    fechas = pd.date_range(start = f'1/1/{start_year}', end = f'31/12/{start_year + years - 1}')
+
+    #daily precipitation with dry days
+    precipitation = rng.gamma(0.6, 12., (len(fechas), stations))
+    precipitation[rng.random(precipitation.shape) < 0.55] = 0.
+    np.savetxt(os.path.join(directory, 'precipitation_data.txt'), precipitation, fmt = '%.1f', delimiter = '\t')
+
+    station_locations = pd.DataFrame({'ID': [f'ST{k:04d}' for k in range(stations)], 'X': rng.uniform(-92., -82., stations), 'Y': rng.uniform(8., 16., stations)})
+    station_locations.to_csv(os.path.join(directory, 'stations_location.txt'), sep = '\t', index = False)
+
+    wet = np.where(precipitation > 0, precipitation, np.nan)
+    quantiles = np.nanquantile(wet, [0.6, 0.75, 0.9], axis = 0)
+    Thresholds = pd.DataFrame({'ID': station_locations['ID'], 'distribution': 'synthetic', 'Green': quantiles[0], 'Yellow': quantiles[1], 'Red': quantiles[2]})
+    Thresholds.to_csv(os.path.join(directory, 'thresholds.csv'))
+
+    #TC tracks, 6-hourly fixes with comma decimals as in the original data
+    x_min, x_max = (location[0] - apt_size/2, location[0] + cols*apt_size)
+    y_min, y_max = (location[1] - apt_size/2, location[1] + rows*apt_size*np.sqrt(3)/2 + apt_size/2)
+    with open(os.path.join(directory, 'TCs_data.txt'), 'w') as file:
+        file.write('event\tday\tmonth\tyear\tlat\tlon\thour\twindkph\tpress\ttypemax\n')
+        for event in range(storms):
+            start = fechas[int(rng.integers(1, len(fechas) - 11))]
+            fixes = int(rng.integers(12, 41))
+            lon = rng.uniform(x_min, x_max) + np.cumsum(rng.normal(-0.4, 0.3, fixes))
+            lat = rng.uniform(y_min, y_max) + np.cumsum(rng.normal(0.2, 0.3, fixes))
+            times = start + pd.to_timedelta(6*np.arange(fixes), unit = 'h')
+            for k in range(fixes):
+                file.write(f'{event}\t{times[k].day}\t{times[k].month}\t{times[k].year}\t{lat[k]:.1f}\t{lon[k]:.1f}\t{times[k].hour}\t100\t990\tTS\n'.replace('.', ','))
+    return {'period': [f'1/1/{start_year}', f'31/12/{start_year + years - 1}'], 'location': list(location), 'cols': cols, 'rows': rows, 'apt_size': apt_size}
+
+def _timed(function, *args, repeat: int = 1, **kwargs):
+    """
+    Parameters:
+        function (function): function to time
+        repeat (int): number of calls, the fastest one is kept
+
+    Return:
+        Tuple with the result of the last call and the best wall time in seconds
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+def time_stages(directory: str, config: dict, hour_correction: float = 6, repeat: int = 1, fit_hexagons: int = 1, render: bool = True, dpi: int = 650) -> dict:
+    """
+    Parameters:
+        directory (str): directory with the input files (generate_synthetic_data)
+        config (dict): arguments of Tool.main that match the data (period, location, cols, rows, apt_size)
+        hour_correction (float): hours used to shift the TCs data
+        repeat (int): number of repetitions of the cheap stages, the fastest one is reported
+        fit_hexagons (int): number of populated hexagons whose probabilities are fitted, 0 skips the fitting stage
+        render (boolean): if False the rendering stage is skipped
+        dpi (int): resolution of the rendered images
+
+    Process:
+        Runs the stages of Tool.main one by one on the data and times each of them separately
+
+    Return:
+        Dictionary with the sizes of the data and the wall time (seconds) of every stage, None for skipped stages. The
+        probabilities stages are timed per hexagon, the empirical one over all populated hexagons
+    """
+    stages, sizes = ({}, {})
+    prepc_data, stages['read_precipitation'] = _timed(loader.parse_precipitation, os.path.join(directory, 'precipitation_data.txt'), repeat = repeat)
+    TCs, stages['read_tcs'] = _timed(loader.parse_tcs, os.path.join(directory, 'TCs_data.txt'), repeat = repeat)
+    station_locations = loader.parse_stations(os.path.join(directory, 'stations_location.txt'))
+    Thresholds = pd.read_csv(os.path.join(directory, 'thresholds.csv'), delimiter = ",")
+    prepc_data = prepc_data.set_index(pd.date_range(start=config['period'][0], end=config['period'][1]))
+
+    shifted = TCs.assign(hour = TCs['hour'] - hour_correction)
+    _, stages['time_correction'] = _timed(lambda: aux.time_correction(shifted.copy()), repeat = repeat)
+    (TCs_means, IR_dates), stages['daily_means'] = _timed(aux.daily_means, TCs, hour_correction, repeat = repeat)
+    TCs_IR_JOIN = pd.concat([TCs_means, prepc_data.loc[IR_dates,:]], axis=1)
+
+    scale, xpos, ypos = (config['apt_size'], config['location'][0], config['location'][1])
+    x_cent, y_cent = aux.hex_centers(config['cols'], config['rows'], scale, xpos, ypos)
+    coords = list(zip(x_cent, y_cent))
+    r = scale/np.sqrt(3)
+    ncols, nrows = (config['cols'], config['rows'])
+    _, stages['polygon_points'] = _timed(lambda: hex_grid.from_points(TCs_IR_JOIN, *aux.polygon_points(TCs_IR_JOIN, coords, r, ncols, nrows), ncols, nrows), repeat = repeat)
+    grid, stages['bin_points'] = _timed(lambda: hex_grid.from_points(TCs_IR_JOIN, *aux.bin_points(TCs_IR_JOIN, coords, r, scale, xpos, ypos, ncols, nrows), ncols, nrows), repeat = repeat)
+
+    populated = sorted((grid.block(pos) for pos in grid.populated(aux.MIN_SAMPLES)), key = len, reverse = True)
+    sizes = {'days': len(prepc_data), 'stations': prepc_data.shape[1], 'tc_records': len(TCs), 'tc_daily_means': len(TCs_means),
+             'hexagons': config['cols']*config['rows'], 'populated_hexagons': len(populated)}
+    stages['empirical_probabilities'] = None
+    if populated:
+        _, seconds = _timed(lambda: [aux.get_probabilities(block, Thresholds, estimator = 'empirical') for block in populated], repeat = repeat)
+        stages['empirical_probabilities'] = seconds/len(populated)
+    stages['get_probabilities'] = None
+    probabilities_df = None
+    if fit_hexagons > 0 and populated:
+        start = time.perf_counter()
+        for block in populated[:fit_hexagons]:
+            probabilities_df = aux.get_probabilities(block, Thresholds, headless = True)
+        stages['get_probabilities'] = (time.perf_counter() - start)/min(fit_hexagons, len(populated))
+
+    stages['make_figures'] = None
+    if render and probabilities_df is not None:
+        try:
+            import pygmt
+        except ImportError:
+            pygmt = None
+        if pygmt is not None:
+            savedir = os.path.join(directory, 'Images')
+            os.makedirs(savedir, exist_ok = True)
+            _, stages['make_figures'] = _timed(plot.make_figures, probabilities_df, x_cent[0], y_cent[0], station_locations, [-93, -81, 7, 17], "c0.15c", "M15c", savedir, dpi)
+    return {'sizes': sizes, 'stages': stages}
+
+def run_benchmarks(configs: List[dict], output: str = 'benchmark_results.json', **kwargs) -> dict:
+    """
+    Parameters:
+        configs (List of dict): arguments of generate_synthetic_data for every point of the scaling curves
+        output (str): path of the json report, None does not save it
+        kwargs: arguments passed to time_stages
+
+    Process:
+        Generates the synthetic data of every configuration in a temporary directory and times all stages on it
+
+    Return:
+        Dictionary with the machine description and the sizes and stage timings of every configuration
+    """
+    results = []
+    for config in configs:
+        with tempfile.TemporaryDirectory() as directory:
+            main_args = generate_synthetic_data(directory, **config)
+            timings = time_stages(directory, main_args, **kwargs)
+        results.append({'config': config, **timings})
+        stages = ', '.join(f'{stage}={seconds:.4f}s' for stage, seconds in timings['stages'].items() if seconds is not None)
+        print(f'{config}: {stages}')
+    report = {'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                          'numpy': np.__version__, 'pandas': pd.__version__}, 'results': results}
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent = 2)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Times every stage of Tool.main on synthetic data of increasing size')
+    parser.add_argument('--years', type = int, nargs = '+', default = [5])
+    parser.add_argument('--stations', type = int, nargs = '+', default = [20])
+    parser.add_argument('--storms', type = int, nargs = '+', default = [100])
+    parser.add_argument('--cols', type = int, nargs = '+', default = [5])
+    parser.add_argument('--rows', type = int, nargs = '+', default = [4])
+    parser.add_argument('--apt-size', type = float, default = 2.)
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--fit-hexagons', type = int, default = 1, help = 'populated hexagons fitted with distfit, 0 skips fitting')
+    parser.add_argument('--no-render', action = 'store_true', help = 'skip the PyGMT rendering stage')
+    parser.add_argument('--dpi', type = int, default = 650)
+    parser.add_argument('--output', default = 'benchmark_results.json')
+    args = parser.parse_args()
+    configs = [{'years': years, 'stations': stations, 'storms': storms, 'cols': cols, 'rows': rows, 'apt_size': args.apt_size}
+               for years, stations, storms, cols, rows in itertools.product(args.years, args.stations, args.storms, args.cols, args.rows)]
+    run_benchmarks(configs, args.output, repeat = args.repeat, fit_hexagons = args.fit_hexagons, render = not args.no_render, dpi = args.dpi)
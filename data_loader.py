@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+from typing import Callable
+import numpy as np
+import pandas as pd
+
+def parse_precipitation(path: str) -> pd.DataFrame:
+    """
+    Parameters:
+        path (str): tab delimited file with the daily precipitation of each station (one column per station)
+
+    Return:
+        pd DataFrame with the precipitation data
+    """
+    return pd.read_csv(path, delimiter = "\t", header=None)
+
+def parse_stations(path: str) -> pd.DataFrame:
+    """
+    Parameters:
+        path (str): tab delimited file with the stations location
+
+    Return:
+        pd DataFrame with the stations location data
+    """
+    return pd.read_csv(path, delimiter ="\t")
+
+def parse_tcs(path: str) -> pd.DataFrame:
+    """
+    Parameters:
+        path (str): tab delimited file with the TCs data
+
+    Return:
+        pd DataFrame with the TCs data that is used ('event', 'day', 'month', 'year', 'lat', 'lon', 'hour')
+    """
+    TCs = pd.read_csv(path, delimiter = "\t", header = None, skiprows=1)
+
+    #setting the header and dropping the data that wont be used
+    TCs.columns = ['event', 'day', 'month', 'year', 'lat', 'lon', 'hour', 'windkph', 'press', 'typemax']
+    TCs = TCs.drop(columns = ['windkph', 'press', 'typemax'])
+    TCs = TCs.reset_index(drop=True)
+
+    TCs = TCs.replace(',','.', regex=True)
+    TCs = TCs.astype({'lat': float, 'lon': float})
+    return TCs
+
+def read_tc_chunks(path: str = 'TCs_data.txt', chunksize: int = 100_000):
+    """
+    Parameters:
+        path (str): tab delimited file with the TCs data
+        chunksize (int): number of records read at a time
+
+    Process:
+        Reads only the columns that are used, a chunk of records at a time, and fixes the decimal commas of the coordinates only
+
+    Return:
+        Generator of pd DataFrame with the TCs data that is used ('event', 'day', 'month', 'year', 'lat', 'lon', 'hour'), as parse_tcs
+    """
+    reader = pd.read_csv(path, delimiter = "\t", header = None, skiprows=1, usecols = range(7), chunksize = chunksize)
+    for TCs in reader:
+        TCs.columns = ['event', 'day', 'month', 'year', 'lat', 'lon', 'hour']
+        for column in ['lat', 'lon']:
+            if not pd.api.types.is_numeric_dtype(TCs[column]):
+                TCs[column] = TCs[column].str.replace(',', '.', regex = False)
+        yield TCs.astype({'lat': float, 'lon': float})
+
+def source_signature(path: str) -> dict:
+    """
+    Parameters:
+        path (str): source text file
+
+    Return:
+        Dictionary with the absolute path, size and modification time of the file, used to invalidate its binary store
+    """
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def write_store(store: str, df: pd.DataFrame, signature: dict, matrix_dtype = None) -> None:
+    """
+    Parameters:
+        store (str): directory of the binary store
+        df (pd DataFrame): parsed data
+        signature (dict): signature of the source file (source_signature)
+        matrix_dtype (numpy dtype): if given, the whole frame is saved as one column-major matrix of this type,
+                                    otherwise every column is saved in its own file
+
+    Process:
+        Saves the data in .npy files that can be memory mapped. meta.json is written last, so an interrupted
+        conversion is never taken as valid
+    """
+    if os.path.isdir(store):
+        shutil.rmtree(store)
+    os.makedirs(store)
+    columns = [column.item() if isinstance(column, np.generic) else column for column in df.columns]
+    if matrix_dtype is not None:
+        np.save(os.path.join(store, 'matrix.npy'), np.asfortranarray(df.to_numpy(dtype = matrix_dtype)))
+    else:
+        for k, column in enumerate(df.columns):
+            values = df[column].to_numpy()
+            if values.dtype == object:
+                values = values.astype(str)
+            np.save(os.path.join(store, f'column_{k}.npy'), values)
+    meta = {'signature': signature, 'columns': columns, 'matrix': matrix_dtype is not None}
+    with open(os.path.join(store, 'meta.json'), 'w') as file:
+        json.dump(meta, file)
+
+def read_store(store: str, signature: dict) -> pd.DataFrame:
+    """
+    Parameters:
+        store (str): directory of the binary store
+        signature (dict): signature of the source file (source_signature)
+
+    Return:
+        pd DataFrame mapped from the binary store without copying the data, None if the store is missing or outdated
+    """
+    try:
+        with open(os.path.join(store, 'meta.json')) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if meta['signature'] != signature:
+        return None
+    if meta['matrix']:
+        matrix = np.load(os.path.join(store, 'matrix.npy'), mmap_mode = 'r')
+        return pd.DataFrame(matrix, columns = meta['columns'], copy = False)
+    data = {column: np.load(os.path.join(store, f'column_{k}.npy'), mmap_mode = 'r') for k, column in enumerate(meta['columns'])}
+    return pd.DataFrame(data, columns = meta['columns'], copy = False)
+
+def load_cached(path: str, cache_dir: str, parse: Callable[[str], pd.DataFrame], matrix_dtype = None) -> pd.DataFrame:
+    """
+    Parameters:
+        path (str): source text file
+        cache_dir (str): directory of the binary stores, None parses the text file every time
+        parse (function): parser of the text file
+        matrix_dtype (numpy dtype): if given, the data is stored as one matrix of this type (write_store)
+
+    Process:
+        Parses the text file only when its binary store is missing, the file changed since it was converted or the store was
+        written with another matrix_dtype
+
+    Return:
+        pd DataFrame with the data
+    """
+    if cache_dir is None:
+        return parse(path)
+    store = os.path.join(cache_dir, os.path.splitext(os.path.basename(path))[0])
+    signature = {**source_signature(path), 'dtype': None if matrix_dtype is None else np.dtype(matrix_dtype).str}
+    df = read_store(store, signature)
+    if df is None:
+        write_store(store, parse(path), signature, matrix_dtype)
+        df = read_store(store, signature)
+    return df
+
+def load_precipitation(path: str = 'precipitation_data.txt', cache_dir: str = None, dtype = np.float64) -> pd.DataFrame:
+    """
+    Parameters:
+        path (str): tab delimited file with the daily precipitation of each station
+        cache_dir (str): directory of the binary stores, None parses the text file every time
+        dtype (numpy dtype): type of the binary store. float64 gives the same values as the text file. float32 halves the size
+                             of the store but rounds the values, which can change the fitted distributions, thresholds and
+                             probabilities, and the fits are not shared in the fit cache with runs that parse the text file
+
+    Return:
+        pd DataFrame with the precipitation data. When it comes from the binary store it is a memory map of type dtype
+    """
+    return load_cached(path, cache_dir, parse_precipitation, dtype)
+
+def load_stations(path: str = 'stations_location.txt', cache_dir: str = None) -> pd.DataFrame:
+    """
+    Parameters:
+        path (str): tab delimited file with the stations location
+        cache_dir (str): directory of the binary stores, None parses the text file every time
+
+    Return:
+        pd DataFrame with the stations location data
+    """
+    return load_cached(path, cache_dir, parse_stations)
+
+def load_tcs(path: str = 'TCs_data.txt', cache_dir: str = None) -> pd.DataFrame:
+    """
+    Parameters:
+        path (str): tab delimited file with the TCs data
+        cache_dir (str): directory of the binary stores, None parses the text file every time
+
+    Return:
+        pd DataFrame with the TCs data that is used ('event', 'day', 'month', 'year', 'lat', 'lon', 'hour')
+    """
+    return load_cached(path, cache_dir, parse_tcs)
+
+def precipitation_chunks(path: str = 'precipitation_data.txt', cache_dir: str = None, chunk: int = 64):
+    """
+    Parameters:
+        path (str): tab delimited file with the daily precipitation of each station
+        cache_dir (str): directory of the binary stores, None reads the columns of the text file
+        chunk (int): number of stations read at a time
+
+    Process:
+        Reads the precipitation a few stations at a time, so the whole file is never held in memory. With a binary store the
+        columns are sliced from its column-major memory map, otherwise only the columns of the chunk are parsed from the text file
+
+    Return:
+        Generator of tuples with the position of the first station of the chunk and the precipitation of its stations (np array)
+    """
+    if cache_dir is not None:
+        matrix = load_precipitation(path, cache_dir).to_numpy()
+        for start in range(0, matrix.shape[1], chunk):
+            yield start, np.array(matrix[:, start:start + chunk], dtype = float)
+        return
+    with open(path) as file:
+        ncolumns = len(file.readline().split('\t'))
+    for start in range(0, ncolumns, chunk):
+        columns = list(range(start, min(start + chunk, ncolumns)))
+        yield start, pd.read_csv(path, delimiter = "\t", header = None, usecols = columns).to_numpy(dtype = float)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+from functools import lru_cache
+from importlib import metadata
+from typing import Tuple, List, Optional
+import numpy as np
+
+MAX_CACHE_BYTES = 64*1024**2 #default size limit of the fit cache directory
+
+@lru_cache(maxsize = None)
+def library_version() -> str:
+    """
+    Return:
+        String with the versions of the libraries that define a fit (distfit and scipy)
+    """
+    versions = []
+    for package in ['distfit', 'scipy']:
+        try:
+            versions.append(f'{package}={metadata.version(package)}')
+        except metadata.PackageNotFoundError:
+            versions.append(f'{package}=unknown')
+    return ';'.join(versions)
+
+def sample_key(data: np.ndarray, distr, smooth = None) -> str:
+    """
+    Parameters:
+        data (np array): sample that is fitted
+        distr (str or List of str): distributions tried by distfit
+        smooth (int): smoothing factor used by distfit
+
+    Return:
+        Hexadecimal hash identifying the fit of the sample with the given settings and library versions
+    """
+    settings = json.dumps({'distr': distr, 'smooth': smooth, 'version': library_version()}, sort_keys = True)
+    digest = hashlib.sha256(settings.encode())
+    digest.update(np.ascontiguousarray(data, dtype = float).tobytes())
+    return digest.hexdigest()
+
+def load_fit(cache_dir: str, key: str) -> Optional[Tuple[str, List[float], int]]:
+    """
+    Parameters:
+        cache_dir (str): directory of the fit cache
+        key (str): hash of the sample and settings (sample_key)
+
+    Return:
+        Tuple with the name, parameters and number of candidate distributions of the cached fit, None if the fit is not cached
+    """
+    path = os.path.join(cache_dir, f'{key}.json')
+    try:
+        with open(path) as file:
+            entry = json.load(file)
+        os.utime(path) #keeps recently used fits away from eviction
+    except (OSError, ValueError):
+        return None
+    return entry['name'], entry['params'], entry.get('candidates', 0)
+
+def store_fit(cache_dir: str, key: str, name: str, params: List[float], candidates: int = 0) -> None:
+    """
+    Parameters:
+        cache_dir (str): directory of the fit cache
+        key (str): hash of the sample and settings (sample_key)
+        name (str): name of the fitted scipy distribution
+        params (List of floats): parameters of the fitted distribution, loc and scale last
+        candidates (int): number of distributions tried by the fit
+
+    Process:
+        Saves the fit in the cache. The file is written under a temporary name first, so parallel workers never read a partial entry
+    """
+    os.makedirs(cache_dir, exist_ok = True)
+    path = os.path.join(cache_dir, f'{key}.json')
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump({'name': name, 'params': [float(param) for param in params], 'candidates': int(candidates)}, file)
+    os.replace(temporary, path)
+
+def prune(cache_dir: str, max_bytes: int = MAX_CACHE_BYTES) -> None:
+    """
+    Parameters:
+        cache_dir (str): directory of the fit cache
+        max_bytes (int): maximum size of the cache
+
+    Process:
+        Deletes the least recently used fits until the cache fits in max_bytes
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.json'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    size = sum(entry[1] for entry in entries)
+    for mtime, entry_size, path in sorted(entries):
+        if size <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        size -= entry_size
+
+def distribution(name: str):
+    """
+    Parameters:
+        name (str): name of a fitted distribution
+
+    Return:
+        scipy.stats distribution with that name
+    """
+    from scipy import stats
+    return getattr(stats, name)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import itertools
+from typing import List
+import numpy as np
+import pandas as pd
+import auxiliar_functions as aux
+import data_loader as loader
+
+def load_tc_positions(hour_correction: float = 0, period: List[str] = None, data_cache: str = None) -> pd.DataFrame:
+    """
+    Parameters:
+        hour_correction (float): hours necessary to match TCs data to the precipitation data time zone
+        period (List of str): start and end dates 'day/month/year', None keeps all dates
+        data_cache (str): directory of the binary copies of the input files, None reads the text files
+
+    Process:
+        Loads the TCs data and computes the daily average position of each TC once, to be reused by sweep_grids
+
+    Return:
+        pd DataFrame with the daily average positions ('lat', 'lon') indexed by date
+    """
+    TCs = loader.load_tcs(cache_dir = data_cache)
+    TCs_means, IR_dates = aux.daily_means(TCs, hour_correction)
+    if period is not None:
+        fechas = pd.date_range(start=period[0], end=period[1])
+        TCs_means = TCs_means[(IR_dates >= fechas[0]) & (IR_dates <= fechas[-1])]
+    return TCs_means
+
+def grid_candidates(locations: List[List[float]], apt_sizes: List[float], cols: List[int], rows: List[int]) -> pd.DataFrame:
+    """
+    Parameters:
+        locations (List of List of floats): centers of the lower left corner hexagon to try
+        apt_sizes (List of floats): double of the hexagon apotheme sizes to try
+        cols (List of integers): numbers of columns to try
+        rows (List of integers): numbers of rows to try
+
+    Return:
+        pd DataFrame with every combination of the given values ('x', 'y', 'apt_size', 'cols', 'rows')
+    """
+    candidates = [[location[0], location[1], apt_size, ncols, nrows] for location, apt_size, ncols, nrows in itertools.product(locations, apt_sizes, cols, rows)]
+    return pd.DataFrame(candidates, columns = ['x', 'y', 'apt_size', 'cols', 'rows'])
+
+def sweep_grids(positions: pd.DataFrame, candidates: pd.DataFrame, min_samples: int = aux.MIN_SAMPLES, max_elements: int = 2_000_000) -> pd.DataFrame:
+    """
+    Parameters:
+        positions (pd DataFrame): daily average positions of the TCs ('lat', 'lon'), as returned by load_tc_positions
+        candidates (pd DataFrame): grids to evaluate ('x', 'y', 'apt_size', 'cols', 'rows'), as returned by grid_candidates
+        min_samples (int): minimum number of TCs for a hexagon to be analyzed by Probs_grid
+        max_elements (int): maximum number of (grid, TC) pairs binned at once, bounds the memory used
+
+    Process:
+        Bins the TCs in all candidate grids at once with hex_cells, broadcasting the grid parameters against the TC positions,
+        and computes the occupancy of every grid without plotting. Only the few points lying exactly on a hexagon edge are
+        tested against the polygons (edge_cells), so the counts are the same as HexGrid.counts of the grid built by create_hex_grid
+
+    Return:
+        pd DataFrame with one row per candidate ranked by the number of hexagons with at least min_samples TCs, then by
+        the number of TCs inside the grid and the median count per hexagon
+    """
+    lons = positions['lon'].to_numpy(dtype = float)[None, :]
+    lats = positions['lat'].to_numpy(dtype = float)[None, :]
+    x = candidates['x'].to_numpy(dtype = float)
+    y = candidates['y'].to_numpy(dtype = float)
+    scale = candidates['apt_size'].to_numpy(dtype = float)
+    ncols = candidates['cols'].to_numpy(dtype = np.int64)
+    nrows = candidates['rows'].to_numpy(dtype = np.int64)
+    chunk = max(1, max_elements // max(lons.shape[1], 1))
+    stats = []
+    for start in range(0, len(candidates), chunk):
+        part = slice(start, start + chunk)
+        part_cols, part_rows = (ncols[part, None], nrows[part, None])
+        rows, columns, distance = aux.hex_cells(lons, lats, part_cols, part_rows, scale[part, None], x[part, None], y[part, None])
+        edge = np.abs(distance - 1) < 1e-9
+        inside = ~edge & (rows >= 0) & (rows < part_rows) & (columns >= 0) & (columns < part_cols)
+        ncells = (ncols[part]*nrows[part])
+        offsets = np.concatenate([[0], np.cumsum(ncells)])
+        cells = (offsets[:-1, None] + rows*part_cols + columns)[inside]
+        counts = np.bincount(cells, minlength = offsets[-1]).astype(float)
+        for k in np.flatnonzero(edge.any(axis = 1)):
+            candidate = start + k
+            centers = list(zip(*aux.hex_centers(ncols[candidate], nrows[candidate], scale[candidate], x[candidate], y[candidate])))
+            _, edge_positions = aux.edge_cells(lons[0], lats[0], np.flatnonzero(edge[k]), rows[k], columns[k], centers, scale[candidate]/np.sqrt(3), ncols[candidate], nrows[candidate])
+            np.add.at(counts, offsets[k] + edge_positions, 1)
+        padded = np.full((len(ncells), ncells.max()), np.nan)
+        padded[np.arange(ncells.max())[None, :] < ncells[:, None]] = counts
+        stats.append(np.column_stack([ncells, np.nansum(padded, axis = 1), (padded >= min_samples).sum(axis = 1),
+                                      np.nanmin(padded, axis = 1), np.nanmedian(padded, axis = 1), np.nanmax(padded, axis = 1)]))
+    stats = np.concatenate(stats) if stats else np.empty((0, 6))
+    results = candidates[['x', 'y', 'apt_size', 'cols', 'rows']].reset_index(drop = True)
+    results[['hexagons', 'tcs_in_grid', 'valid_hexagons']] = stats[:, :3].astype(np.int64)
+    results[['min_count', 'median_count', 'max_count']] = stats[:, 3:]
+    results = results.sort_values(['valid_hexagons', 'tcs_in_grid', 'median_count'], ascending = False, kind = 'stable')
+    return results.reset_index(drop = True)
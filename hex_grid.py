@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from typing import List, NamedTuple
+import numpy as np
+import pandas as pd
+
+class HexGrid(NamedTuple):
+    """
+    Compact hexagonal grid. The induced precipitation of the TCs inside every hexagon is stored in one contiguous array, sorted by
+    hexagon, and offsets gives the rows of each hexagon (CSR layout), so the data of a hexagon is a view of the shared array.
+    Hexagons are numbered by their Matrix position (row*ncolumns + column). A TC lying on the edge of two hexagons has one row in each
+
+    Fields:
+        precipitation (np array): induced precipitation of every (hexagon, TC) pair, one column per station
+        offsets (np array): first row of every hexagon in precipitation, plus the total number of rows at the end
+        points (np array): position of every row in the binned data (dates, lat, lon)
+        dates (pd DatetimeIndex): date of every binned TC daily position
+        lat (np array): latitude of every binned TC daily position
+        lon (np array): longitude of every binned TC daily position
+        stations (pd Index): labels of the station columns
+        ncolumns (int): number of columns of the grid
+        nrows (int): number of rows of the grid
+    """
+    precipitation: np.ndarray
+    offsets: np.ndarray
+    points: np.ndarray
+    dates: pd.DatetimeIndex
+    lat: np.ndarray
+    lon: np.ndarray
+    stations: pd.Index
+    ncolumns: int
+    nrows: int
+
+    def counts(self) -> np.ndarray:
+        """
+        Return:
+            np array with the number of TCs inside every hexagon
+        """
+        return np.diff(self.offsets)
+
+    def populated(self, min_samples: int) -> List[int]:
+        """
+        Parameters:
+            min_samples (int): minimum number of TCs inside a hexagon
+
+        Return:
+            List with the positions of the hexagons with at least min_samples TCs
+        """
+        return [int(pos) for pos in np.flatnonzero(self.counts() >= min_samples)]
+
+    def position(self, i: int, j: int) -> int:
+        """
+        Parameters:
+            i (int): row of the Matrix
+            j (int): column of the Matrix
+
+        Return:
+            Position of the hexagon (row*ncolumns + column)
+        """
+        return i*self.ncolumns + j
+
+    def block(self, pos: int) -> np.ndarray:
+        """
+        Parameters:
+            pos (int): position of the hexagon
+
+        Return:
+            np array with the induced precipitation of the TCs inside the hexagon, a view of the shared array
+        """
+        return self.precipitation[self.offsets[pos]:self.offsets[pos+1]]
+
+    def rows(self, pos: int) -> np.ndarray:
+        """
+        Parameters:
+            pos (int): position of the hexagon
+
+        Return:
+            np array with the positions in the binned data (dates, lat, lon) of the TCs inside the hexagon
+        """
+        return self.points[self.offsets[pos]:self.offsets[pos+1]]
+
+    def frame(self, pos: int) -> pd.DataFrame:
+        """
+        Parameters:
+            pos (int): position of the hexagon
+
+        Return:
+            pd DataFrame with the TCs inside the hexagon and their precipitation indexed by date, as the cells of the Matrix
+            returned by to_matrix. It is a copy, meant for inspection and export
+        """
+        rows = self.rows(pos)
+        df = pd.DataFrame(self.block(pos), index = self.dates[rows], columns = self.stations)
+        df.insert(0, 'lon', self.lon[rows])
+        df.insert(0, 'lat', self.lat[rows])
+        return df
+
+    def to_matrix(self) -> List[List[pd.DataFrame]]:
+        """
+        Return:
+            Matrix (List of List of pd DataFrame) with the corresponding TCs inside the hexagons and precipitation
+        """
+        return [[self.frame(self.position(i, j)) for j in range(self.ncolumns)] for i in range(self.nrows)]
+
+def from_points(df: pd.DataFrame, points: np.ndarray, cells: np.ndarray, ncolumns: int, nrows: int) -> HexGrid:
+    """
+    Parameters:
+        df (pd DataFrame): latitude and longitude of TCs with its induced precipitation
+        points (np array): row of df of every (hexagon, TC) pair
+        cells (np array): position of the hexagon of every pair, sorted
+        ncolumns (int): number of columns of the grid
+        nrows (int): number of rows of the grid
+
+    Return:
+        HexGrid with the precipitation of the pairs copied once into one contiguous array
+    """
+    stations = df.columns.drop(['lat', 'lon'])
+    precipitation = np.ascontiguousarray(df[stations].to_numpy()[points])
+    offsets = np.searchsorted(cells, np.arange(nrows*ncolumns + 1))
+    return HexGrid(precipitation, offsets, np.asarray(points, dtype = np.int64), pd.DatetimeIndex(df.index), df['lat'].to_numpy(dtype = float),
+                   df['lon'].to_numpy(dtype = float), stations, ncolumns, nrows)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, List, Optional
+
+def current_rss() -> Optional[int]:
+    """
+    Return:
+        Resident memory of this process in bytes, None where /proc/self/statm is not available
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def max_rss() -> Optional[float]:
+    """
+    Return:
+        Highest resident memory reached by this process so far in MB, None on Windows
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/1024**2 if sys.platform == 'darwin' else peak/1024 #bytes on macOS, kilobytes on Linux
+
+class Profiler:
+    """
+    Collects the wall time, CPU time and peak memory of the stages of a run, and the timings of every hexagon and distribution fit.
+
+    Parameters:
+        callbacks (List of functions): functions called as callback(event, record) when a stage ends (event 'stage'), or a
+                                       hexagon (event 'hexagon') or fit (event 'fit') is recorded
+        trace_memory (boolean): if True the peak memory allocated by Python in every stage is also measured with tracemalloc. It slows
+                                down every allocation, so in this mode no times are recorded, only memory
+        report_path (str): path of the json run report written by save, None does not write it
+        sample_interval (float): seconds between the samples of the resident memory taken while a stage is open
+    """
+    def __init__(self, callbacks: List[Callable[[str, dict], None]] = None, trace_memory: bool = False, report_path: str = None, sample_interval: float = 0.01):
+        self.callbacks = list(callbacks or [])
+        self.trace_memory = trace_memory
+        self.report_path = report_path
+        self.sample_interval = sample_interval
+        self.stages = []
+        self.hexagons = []
+        self.fits = []
+        self._open_peaks = [] #running peak traced memory of the stages being measured, innermost last
+        self._open_rss = [] #running peak resident memory of the stages being measured, innermost last
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def _emit(self, event: str, record: dict) -> None:
+        for callback in self.callbacks:
+            callback(event, record)
+
+    def _sample_rss(self) -> None:
+        rss = current_rss()
+        if rss is None:
+            return
+        with self._lock:
+            self._open_rss = [max(open_rss, rss) for open_rss in self._open_rss]
+
+    def _run_sampler(self) -> None:
+        while not self._stop.wait(self.sample_interval):
+            self._sample_rss()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **info):
+        """
+        Parameters:
+            name (str): name of the stage
+            info: extra values saved with the stage record
+
+        Process:
+            Measures the code run inside the with block. The peak resident memory of the stage is sampled by a background thread,
+            which does not slow down the measured code. Memory used by worker processes is not included
+        """
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            peak = tracemalloc.get_traced_memory()[1]
+            self._open_peaks = [max(open_peak, peak) for open_peak in self._open_peaks]
+            tracemalloc.reset_peak()
+            self._open_peaks.append(0)
+        with self._lock:
+            self._open_rss.append(0)
+        self._sample_rss()
+        if self._sampler is None and current_rss() is not None:
+            self._stop.clear()
+            self._sampler = threading.Thread(target = self._run_sampler, daemon = True)
+            self._sampler.start()
+        wall, cpu = (time.perf_counter(), time.process_time())
+        try:
+            yield
+        finally:
+            record = {'stage': name} if self.trace_memory else {'stage': name, 'wall_s': time.perf_counter() - wall, 'cpu_s': time.process_time() - cpu}
+            record.update(info)
+            self._sample_rss()
+            with self._lock:
+                rss = self._open_rss.pop()
+                self._open_rss = [max(open_rss, rss) for open_rss in self._open_rss]
+                outermost = not self._open_rss
+            if outermost and self._sampler is not None:
+                self._stop.set()
+                self._sampler.join()
+                self._sampler = None
+            if rss:
+                record['peak_rss_mb'] = rss/1024**2
+            record['max_rss_mb'] = max_rss()
+            if self.trace_memory:
+                peak = max(self._open_peaks.pop(), tracemalloc.get_traced_memory()[1])
+                self._open_peaks = [max(open_peak, peak) for open_peak in self._open_peaks]
+                record['peak_traced_mb'] = peak/1024**2
+            self.stages.append(record)
+            self._emit('stage', record)
+
+    def record_fit(self, **record) -> None:
+        """
+        Parameters:
+            record: values describing the fit (hexagon, station, seconds, distribution, candidates)
+        """
+        if self.trace_memory:
+            record.pop('seconds', None)
+        self.fits.append(record)
+        self._emit('fit', record)
+
+    def record_hexagon(self, **record) -> None:
+        """
+        Parameters:
+            record: values describing the hexagon (hexagon, samples, seconds)
+        """
+        if self.trace_memory:
+            record.pop('seconds', None)
+        self.hexagons.append(record)
+        self._emit('hexagon', record)
+
+    def report(self) -> dict:
+        """
+        Return:
+            Dictionary with all stage, hexagon and fit records, and the total wall time of every stage name
+        """
+        totals = {}
+        for record in self.stages:
+            if 'wall_s' in record:
+                totals[record['stage']] = totals.get(record['stage'], 0.) + record['wall_s']
+        return {'stages': self.stages, 'stage_totals_s': totals, 'hexagons': self.hexagons, 'fits': self.fits, 'max_rss_mb': max_rss()}
+
+    def save(self, path: str = None) -> None:
+        """
+        Parameters:
+            path (str): path of the json run report, None uses report_path
+        """
+        path = path or self.report_path
+        if path is None:
+            return
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent = 2, default = str)
+        if self.trace_memory and tracemalloc.is_tracing() and not self._open_peaks:
+            tracemalloc.stop()
+
+def stage(profiler: Profiler, name: str, **info):
+    """
+    Parameters:
+        profiler (Profiler): profiler of the run, None disables the measurement
+        name (str): name of the stage
+        info: extra values saved with the stage record
+
+    Return:
+        Context manager measuring the stage, or doing nothing when there is no profiler
+    """
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name, **info)
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
-import pygmt
 from typing import Tuple, List
 import numpy as np
 import pandas as pd
 import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+ALERT_LABELS = ['Green', 'Yellow', 'Red']
 
 def vertices(x: float, y: float, radius: float) -> Tuple[float,float]:
     """
@@ -28,7 +32,7 @@ def vertices(x: float, y: float, radius: float) -> Tuple[float,float]:
     vertices_y.append(first_vert[1])
     return vertices_x, vertices_y
 
-def plot_HexGrid(region, x_cent: List[float], y_cent: List[float], r: float, lat, lon, style, projection) -> None:
+def plot_HexGrid(region, x_cent: List[float], y_cent: List[float], r: float, lat, lon, style, projection, savepath: str = 'Hexagonal_Grid_wTCs.png', show: bool = True) -> None:
     """
     Parameters:
         region (List of floats): min/max longitude and latitude coordinates to define the region 
@@ -39,10 +43,13 @@ def plot_HexGrid(region, x_cent: List[float], y_cent: List[float], r: float, lat
         lon (pd Series): Longitude coordinates of all TCs daily average position
         style (str): Marker and size of the scatter plot of TCs
         projection (str):  projection and size of the ima
+        savepath (str): path of the image
+        show (boolean): if True the image is opened in an external viewer
         
     Process:
         Graphic representation of the Hexagonal Grid and TCs daily average position. It saves the produced imagen in .png format 
     """
+    import pygmt
     fig = pygmt.Figure()
     fig.coast(shorelines="0.8p,black", region= region, frame="a", projection = projection, borders=["1/0.8p,black", "2/0.3p,black"] ,land="#efefdb") #, water="skyblue"
     pygmt.makecpt(cmap="red")
@@ -56,10 +63,11 @@ def plot_HexGrid(region, x_cent: List[float], y_cent: List[float], r: float, lat
               pen = "1.15p,black",
           ) #dots "1p,black,."
     fig.legend()
-    fig.show(method="external")
-    fig.savefig('Hexagonal_Grid_wTCs.png', dpi = 650)
+    if show:
+        fig.show(method="external")
+    fig.savefig(savepath, dpi = 650)
     
-def make_figures(df: pd.DataFrame, x_center: float, y_center: float, stations, region, style, projection, savedir) -> None:
+def make_figures(df: pd.DataFrame, x_center: float, y_center: float, stations, region, style, projection, savedir, dpi: int = 650, img_format: str = 'png') -> None:
     """
     Parameters: 
         df (pd DataFrame): Probabilities of extreme precipitation of all stations due to TCs inside one hexagon
@@ -70,29 +78,149 @@ def make_figures(df: pd.DataFrame, x_center: float, y_center: float, stations, r
         style (str): Marker and size of the scatter plot for the stations
         projection (str): projection and size of the image for the stations plot
         savedir (str): directory where you wish to save the final image results
+        dpi (int): resolution of the images
+        img_format (str): format of the images (png, jpg, pdf...)
         
     Process:
         Create an image of the region selected showing the all probabilities of each station and saves it in .png format
     """
-    AlertaVerde = (df.loc[:,'%Green']).to_numpy().flatten()
-    AlertaAmarilla = (df.loc[:,'%Yellow']).to_numpy().flatten()
-    AlertaRoja = (df.loc[:,'%Red']).to_numpy().flatten()
-    Alertas = [AlertaVerde, AlertaAmarilla, AlertaRoja]
-    labels = ['Green', 'Yellow', 'Red']
-    for alerta in range(3):
-        fig = pygmt.Figure()
-        fig.coast(shorelines="0.8p,black", region = region, projection = projection, borders=["1/0.8p,black", "2/0.3p,black"], land="#adadad") #[-95, -75, 5, 20] #, water="skyblue"
-        fig.basemap(frame="a")
-        max_probability = max(Alertas[alerta])
-        pygmt.makecpt(cmap="abyss", reverse = True, series=[0, max_probability]) 
-        fig.plot(x=(stations['X']), y=stations['Y'], style= style, color=Alertas[alerta], cmap=True, pen="black") #style="c0.125c"
-        fig.colorbar(frame=f'af+l"{labels[alerta]} Alert Probability (%)"')
-        # fig.show(method="external")
-        x_center = round(x_center, 2)
-        y_center = round(y_center, 2)
-        img_name = f'LON{x_center}_LAT{y_center}_{labels[alerta]}_alert.png'
-        savepath = os.path.join(savedir, img_name)
-        fig.savefig(savepath, dpi = 650)
+    for alerta in ALERT_LABELS:
+        probabilities = (df.loc[:,f'%{alerta}']).to_numpy().flatten()
+        savepath = os.path.join(savedir, image_name(x_center, y_center, alerta, img_format))
+        render_map(probabilities, alerta, stations['X'], stations['Y'], region, style, projection, savepath, dpi)
 
-    
-    
\ No newline at end of file
+def image_name(x_center: float, y_center: float, alert: str, img_format: str = 'png') -> str:
+    """
+    Parameters:
+        x_center (float): x axis value of the hexagon center
+        y_center (float): y axis value of the hexagon center
+        alert (str): alert level ('Green', 'Yellow' or 'Red')
+        img_format (str): format of the image
+        
+    Return:
+        Name of the image of one hexagon and alert level
+    """
+    return f'LON{round(x_center, 2)}_LAT{round(y_center, 2)}_{alert}_alert.{img_format}'
+
+def render_map(probabilities, alert: str, stations_x, stations_y, region, style, projection, savepath: str, dpi: int = 650) -> None:
+    """
+    Parameters:
+        probabilities (List of floats): Probabilities of extreme precipitation of all stations for one alert level
+        alert (str): alert level ('Green', 'Yellow' or 'Red')
+        stations_x (List of floats): longitude coordinates of the stations
+        stations_y (List of floats): latitude coordinates of the stations
+        region (List of floats): min/max longitude and latitude coordinates to define the region that shows the stations
+        style (str): Marker and size of the scatter plot for the stations
+        projection (str): projection and size of the image for the stations plot
+        savepath (str): path of the image, its extension sets the format
+        dpi (int): resolution of the image
+        
+    Process:
+        Create an image of the region selected showing the probabilities of one alert level in each station
+    """
+    import pygmt
+    fig = pygmt.Figure()
+    fig.coast(shorelines="0.8p,black", region = region, projection = projection, borders=["1/0.8p,black", "2/0.3p,black"], land="#adadad") #[-95, -75, 5, 20] #, water="skyblue"
+    fig.basemap(frame="a")
+    max_probability = max(probabilities)
+    pygmt.makecpt(cmap="abyss", reverse = True, series=[0, max_probability]) 
+    fig.plot(x=stations_x, y=stations_y, style= style, color=probabilities, cmap=True, pen="black") #style="c0.125c"
+    fig.colorbar(frame=f'af+l"{alert} Alert Probability (%)"')
+    # fig.show(method="external")
+    fig.savefig(savepath, dpi = dpi)
+
+def write_render_manifest(path: str, hexagons: List[Tuple[float, float, pd.DataFrame]], stations, region, style, projection, savedir) -> None:
+    """
+    Parameters:
+        path (str): path of the render manifest (.json)
+        hexagons (List of Tuple): x and y center of every analyzed hexagon with its probabilities (pd DataFrame)
+        stations (pd Dataframe): stations locations data
+        region (List of floats): min/max longitude and latitude coordinates to define the region that shows the stations
+        style (str): Marker and size of the scatter plot for the stations
+        projection (str): projection and size of the image for the stations plot
+        savedir (str): directory where the images are saved
+        
+    Process:
+        Saves everything needed to render the maps of the computed probabilities, one entry per hexagon and alert level,
+        so the images can be made later by render_figures without computing the probabilities again
+    """
+    maps = []
+    for x_center, y_center, df in hexagons:
+        for alerta in ALERT_LABELS:
+            probabilities = [float(probability) for probability in df.loc[:,f'%{alerta}']]
+            maps.append({'x_center': float(x_center), 'y_center': float(y_center), 'alert': alerta, 'probabilities': probabilities})
+    manifest = {'region': list(region), 'style': style, 'projection': projection, 'savedir': savedir,
+                'stations': {'X': [float(x) for x in stations['X']], 'Y': [float(y) for y in stations['Y']]}, 'maps': maps}
+    with open(path, 'w') as file:
+        json.dump(manifest, file)
+
+def _render_task(task: Tuple) -> str:
+    """
+    Parameters:
+        task (Tuple): arguments of render_map
+        
+    Return:
+        Path of the rendered image
+    """
+    render_map(*task)
+    return task[7]
+
+def render_figures(manifest_path: str = 'render_manifest.json', n_workers: int = 1, dpi: int = 650, img_format: str = 'png', hexagons: List[Tuple[float, float]] = None, alerts: List[str] = None, force: bool = False) -> List[str]:
+    """
+    Parameters:
+        manifest_path (str): path of the render manifest written by write_render_manifest
+        n_workers (int): number of processes rendering the maps, 1 renders them serially
+        dpi (int): resolution of the images
+        img_format (str): format of the images (png, jpg, pdf...)
+        hexagons (List of Tuple of floats): x and y centers of the hexagons to render, None renders all of them
+        alerts (List of str): alert levels to render, None renders all of them
+        force (boolean): if True the images are rendered even if they are up to date
+        
+    Process:
+        Renders the maps of the manifest. Every image is identified by a hash of its probabilities and render settings,
+        kept in render_state.json inside the images directory, and it is skipped when the image exists with the same hash
+        
+    Return:
+        List with the paths of the rendered images
+    """
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+    savedir = manifest['savedir']
+    state_path = os.path.join(savedir, 'render_state.json')
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as file:
+            state = json.load(file)
+    if hexagons is not None:
+        hexagons = {(round(x_center, 2), round(y_center, 2)) for x_center, y_center in hexagons}
+    settings = {key: manifest[key] for key in ['region', 'style', 'projection', 'stations']}
+    tasks, digests = ([], {})
+    for entry in manifest['maps']:
+        if hexagons is not None and (round(entry['x_center'], 2), round(entry['y_center'], 2)) not in hexagons:
+            continue
+        if alerts is not None and entry['alert'] not in alerts:
+            continue
+        name = image_name(entry['x_center'], entry['y_center'], entry['alert'], img_format)
+        savepath = os.path.join(savedir, name)
+        digest = hashlib.sha256(json.dumps([entry, settings, dpi], sort_keys = True).encode()).hexdigest()
+        if not force and state.get(name) == digest and os.path.exists(savepath):
+            continue
+        digests[savepath] = (name, digest)
+        tasks.append((entry['probabilities'], entry['alert'], manifest['stations']['X'], manifest['stations']['Y'], manifest['region'], manifest['style'], manifest['projection'], savepath, dpi))
+    os.makedirs(savedir, exist_ok = True)
+    rendered = []
+    try:
+        if n_workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers = n_workers) as executor:
+                for savepath in executor.map(_render_task, tasks):
+                    rendered.append(savepath)
+        else:
+            for task in tasks:
+                rendered.append(_render_task(task))
+    finally:
+        for savepath in rendered:
+            name, digest = digests[savepath]
+            state[name] = digest
+        with open(state_path, 'w') as file:
+            json.dump(state, file)
+    return rendered